@@ -7,10 +7,42 @@ Instructions:
 2. Save as 'app.py' (exactly, no .txt extension)
 3. Upload to GitHub along with requirements.txt
 4. Deploy to Streamlit Cloud
+
+Multi-worker deployment:
+Set EHR_STATE_DB to a SQLite file path shared by all app processes, e.g.
+    EHR_STATE_DB=/srv/ehr/state.db streamlit run app.py --server.port 8501
+    EHR_STATE_DB=/srv/ehr/state.db streamlit run app.py --server.port 8502
+and put the workers behind any load balancer. Student progress is keyed by
+the ?student= URL parameter, so any worker can serve any student, and
+derived data is cached next to the database unless EHR_CACHE_DIR is set.
 """
 
+import bisect
+import hashlib
+import heapq
+import hmac
+import io
+import json
+import math
+import os
+import pickle
+import random
+import re
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import plotly.express as px
 import plotly.graph_objects as go
 
@@ -97,6 +129,22 @@ if 'student_stats' not in st.session_state:
         'correct_answers': 0,
         'total_answers': 0
     }
+if 'student_id' not in st.session_state:
+    st.session_state.student_id = st.query_params.get('student') or uuid.uuid4().hex[:8]
+if 'imported_claims' not in st.session_state:
+    st.session_state.imported_claims = {}
+if 'progress_loaded' not in st.session_state:
+    st.session_state.progress_loaded = False
+if 'exam' not in st.session_state:
+    st.session_state.exam = None
+if 'topic_mastery' not in st.session_state:
+    st.session_state.topic_mastery = {}
+if 'topic_cursor' not in st.session_state:
+    st.session_state.topic_cursor = {}
+if 'topic_heap' not in st.session_state:
+    st.session_state.topic_heap = None
+if 'focus_case' not in st.session_state:
+    st.session_state.focus_case = None
 
 # Patient Data - Based on CSV structure provided
 PATIENTS = [
@@ -114,9 +162,9 @@ PATIENTS = [
             'coinsurance': 20
         },
         'claims': [
-            {'date': '2024-07-01', 'service': 'Hospital Stay (3 days)', 'amount': 8500, 'paid': 6800, 'status': 'Paid via DRG'},
-            {'date': '2024-07-15', 'service': 'Cardiology Follow-up', 'amount': 300, 'paid': 240, 'status': 'Part B - 80%'},
-            {'date': '2024-08-01', 'service': 'Lab Work', 'amount': 150, 'paid': 120, 'status': 'Part B - 80%'}
+            {'date': '2024-07-01', 'service': 'Hospital Stay (3 days)', 'amount': 8500, 'paid': 6800, 'status': 'Paid via DRG', 'drg': '194'},
+            {'date': '2024-07-15', 'service': 'Cardiology Follow-up', 'amount': 300, 'paid': 240, 'status': 'Part B - 80%', 'cpt': '99214'},
+            {'date': '2024-08-01', 'service': 'Lab Work', 'amount': 150, 'paid': 120, 'status': 'Part B - 80%', 'cpt': '80053'}
         ],
         'diagnosis': ['Coronary Artery Disease', 'Type 2 Diabetes', 'Hypertension'],
         'medications': ['Metformin 500mg BID', 'Lisinopril 10mg daily', 'Atorvastatin 20mg']
@@ -192,7 +240,9 @@ PATIENTS = [
             'reimbursementModel': 'Fee-for-Service',
             'charity_care': 'Approved - 80% discount',
             'payment_plan': '$100/month',
-            'financial_counselor': 'Lisa Martinez, MSW'
+            'financial_counselor': 'Lisa Martinez, MSW',
+            'household_size': 2, 'household_income': 40880,
+            'payment_plan_monthly': 100
         },
         'claims': [
             {'date': '2024-06-10', 'service': 'ER - Acute MI', 'amount': 12500, 'paid': 2500, 'status': 'Charity care - 80% discount'},
@@ -313,6 +363,7 @@ PATIENTS = [
 LEARNING_CASES = [
     {
         'id': 'case-001', 'patientId': 'patient-001',
+        'topics': ['medicare', 'drg', 'hospital-payment'],
         'title': 'Medicare Hospital DRG Payment',
         'objective': 'Understand how Medicare pays hospitals using DRG rates',
         'scenario': 'John Smith was hospitalized for 3 days. The hospital billed $8,500, but Medicare only paid $6,800 under DRG 194 (cardiac procedures).',
@@ -328,6 +379,7 @@ LEARNING_CASES = [
     },
     {
         'id': 'case-002', 'patientId': 'patient-002',
+        'topics': ['ppo', 'deductibles', 'coinsurance'],
         'title': 'PPO Cost Calculation with Deductible',
         'objective': 'Calculate patient costs under PPO with deductible and coinsurance',
         'scenario': 'Maria needs an MRI costing $2,800. Her PPO has a $2,500 deductible with $1,200 already met, and 20% coinsurance after the deductible.',
@@ -343,6 +395,7 @@ LEARNING_CASES = [
     },
     {
         'id': 'case-003', 'patientId': 'patient-003',
+        'topics': ['medicaid', 'managed-care', 'emergency-services', 'claim-denials'],
         'title': 'Medicaid Managed Care ER Denial',
         'objective': 'Understand appropriate use of emergency services under Medicaid managed care',
         'scenario': 'David went to the ER for anxiety symptoms. His Medicaid managed care plan denied the $2,500 claim, stating "non-emergency use - could have been treated by PCP."',
@@ -358,6 +411,7 @@ LEARNING_CASES = [
     },
     {
         'id': 'case-004', 'patientId': 'patient-004',
+        'topics': ['hmo', 'managed-care', 'referrals', 'claim-denials'],
         'title': 'HMO Referral Requirement',
         'objective': 'Learn about HMO care coordination and referral systems',
         'scenario': 'Sarah needs specialist care for pregnancy complications. Her Kaiser HMO requires a referral from her PCP before she can see the maternal-fetal medicine specialist.',
@@ -373,6 +427,7 @@ LEARNING_CASES = [
     },
     {
         'id': 'case-005', 'patientId': 'patient-005',
+        'topics': ['uninsured', 'charity-care'],
         'title': 'Hospital Charity Care Program',
         'objective': 'Understand charity care eligibility and discount calculations',
         'scenario': 'Robert is uninsured and received an 80% charity care discount. His household income is 200% of the Federal Poverty Level.',
@@ -388,6 +443,7 @@ LEARNING_CASES = [
     },
     {
         'id': 'case-006', 'patientId': 'patient-006',
+        'topics': ['medicare-advantage', 'preventive-care'],
         'title': 'Medicare Advantage Preventive Benefits',
         'objective': 'Learn about preventive care coverage in Medicare Advantage plans',
         'scenario': 'Linda\'s Medicare Advantage plan covered her annual wellness visit and mammography at 100% with no copay.',
@@ -403,6 +459,7 @@ LEARNING_CASES = [
     },
     {
         'id': 'case-007', 'patientId': 'patient-007',
+        'topics': ['hdhp', 'hsa'],
         'title': 'High-Deductible Health Plan with HSA',
         'objective': 'Understand the triple tax advantage of Health Savings Accounts',
         'scenario': 'Michael has a High-Deductible Health Plan with an HSA. He used $180 from his HSA to pay for eligible medical expenses.',
@@ -418,6 +475,7 @@ LEARNING_CASES = [
     },
     {
         'id': 'case-008', 'patientId': 'patient-008',
+        'topics': ['tricare', 'mental-health-parity'],
         'title': 'Tricare Mental Health Coverage',
         'objective': 'Learn about mental health parity in military health benefits',
         'scenario': 'Jennifer receives unlimited mental health therapy sessions through Tricare Prime with the same copay as medical visits.',
@@ -433,6 +491,7 @@ LEARNING_CASES = [
     },
     {
         'id': 'case-009', 'patientId': 'patient-009',
+        'topics': ['ppo', 'preventive-care', 'deductibles', 'coinsurance'],
         'title': 'Screening vs. Diagnostic Colonoscopy',
         'objective': 'Understand how procedure classification affects coverage',
         'scenario': 'Thomas had a "screening" colonoscopy, but when polyps were found and removed, it became "diagnostic" and subject to his deductible and coinsurance.',
@@ -448,6 +507,7 @@ LEARNING_CASES = [
     },
     {
         'id': 'case-010', 'patientId': 'patient-010',
+        'topics': ['medicaid', 'pregnancy-coverage'],
         'title': 'Medicaid Pregnancy Coverage Extension',
         'objective': 'Learn about postpartum Medicaid coverage duration',
         'scenario': 'Amanda qualified for Medicaid during pregnancy and wants to know how long her coverage will last after delivery.',
@@ -464,6 +524,7 @@ LEARNING_CASES = [
     # Additional cases for comprehensive learning
     {
         'id': 'case-011', 'patientId': 'patient-001',
+        'topics': ['medicare', 'coinsurance', 'provider-assignment'],
         'title': 'Medicare Part B Coinsurance',
         'objective': 'Calculate Medicare Part B patient responsibility',
         'scenario': 'John has a cardiology follow-up visit. The doctor charges $300, Medicare approves $240, and pays 80% after the Part B deductible is met.',
@@ -479,6 +540,7 @@ LEARNING_CASES = [
     },
     {
         'id': 'case-012', 'patientId': 'patient-002',
+        'topics': ['value-based-payment', 'reimbursement-models'],
         'title': 'Value-Based Payment Incentives',
         'objective': 'Understand how value-based contracts affect patient care',
         'scenario': 'Maria\'s rheumatologist participates in a value-based payment contract that rewards better patient outcomes and care coordination.',
@@ -494,6 +556,7 @@ LEARNING_CASES = [
     },
     {
         'id': 'case-013', 'patientId': 'patient-003',
+        'topics': ['medicaid', 'capitation', 'reimbursement-models'],
         'title': 'Medicaid Capitation Model',
         'objective': 'Learn how capitation affects healthcare delivery',
         'scenario': 'David\'s Medicaid managed care organization receives a fixed monthly payment per member to provide all his healthcare needs.',
@@ -509,6 +572,7 @@ LEARNING_CASES = [
     },
     {
         'id': 'case-014', 'patientId': 'patient-007',
+        'topics': ['hdhp', 'hsa'],
         'title': 'HSA Contribution Limits and Penalties',
         'objective': 'Learn HSA rules and tax implications',
         'scenario': 'Michael wants to maximize his HSA contributions. For 2024, the individual contribution limit is $4,150, but he\'s considering contributing $5,000.',
@@ -524,6 +588,7 @@ LEARNING_CASES = [
     },
     {
         'id': 'case-015', 'patientId': 'patient-006',
+        'topics': ['medicare-advantage', 'quality-ratings'],
         'title': 'Medicare Advantage Star Ratings',
         'objective': 'Understand Medicare Advantage quality measures',
         'scenario': 'Linda chose her Medicare Advantage plan partly because it has a 4-star rating from Medicare.',
@@ -539,6 +604,150 @@ LEARNING_CASES = [
     }
 ]
 
+def content_hash(obj):
+    """Return a deterministic short hash of JSON-like content"""
+    payload = json.dumps(obj, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+# The one switch for cached artifact layouts: bump it in the same change
+# that alters what any cached artifact holds (case bank, search index,
+# denial cases, patient views), so pickles written by older code are never
+# loaded after a restart. The validate checks are only a safety net.
+ARTIFACT_SCHEMA_VERSION = 3
+# Temp files older than this are orphans of crashed writes, not writes in flight
+ARTIFACT_TMP_MAX_AGE = 3600
+
+class ArtifactCache:
+    """LRU cache for derived artifacts keyed by namespace and content version
+
+    Artifacts live in an in-memory LRU and, when ``disk_dir`` is set, are
+    also pickled to disk so a restarted worker can reuse them. The disk
+    cache is evicted least-recently-used first, using file mtimes that are
+    refreshed on every disk hit. A disk entry that fails to unpickle or
+    fails the caller's ``validate`` check is treated as a miss.
+    """
+    
+    def __init__(self, max_memory_items=256, disk_dir=None, max_disk_items=2048):
+        self.memory = OrderedDict()
+        self.max_memory_items = max_memory_items
+        self.disk_dir = disk_dir
+        self.max_disk_items = max_disk_items
+        self.lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+    
+    def _key(self, namespace, version):
+        return f"{namespace}-s{ARTIFACT_SCHEMA_VERSION}-{version}"
+    
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.pkl")
+    
+    def _remember(self, key, value):
+        with self.lock:
+            self.memory[key] = value
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_memory_items:
+                self.memory.popitem(last=False)
+    
+    def _load_from_disk(self, key, validate=None):
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except OSError:
+            return False, None
+        except Exception:
+            # Unpickling can fail in many ways (renamed classes, truncated files)
+            value = None
+        if value is None or (validate is not None and not validate(value)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return False, None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return True, value
+    
+    def _write_to_disk(self, key, value):
+        # Write to a temp file first so concurrent readers never see partial pickles
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._disk_path(key))
+        except (OSError, pickle.PickleError, TypeError, AttributeError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._evict_disk()
+    
+    def _evict_disk(self):
+        # Other workers evict from the same directory, so any entry may
+        # vanish between scandir and stat/remove
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            try:
+                mtime = entry.stat().st_mtime
+                if entry.name.endswith('.tmp') and now - mtime > ARTIFACT_TMP_MAX_AGE:
+                    os.remove(entry.path)  # Left behind by a crashed write
+                elif entry.name.endswith('.pkl'):
+                    entries.append((mtime, entry.path))
+            except OSError:
+                continue
+        if len(entries) <= self.max_disk_items:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_disk_items]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    def get(self, namespace, version, validate=None):
+        """Return ``(found, artifact)`` without computing anything"""
+        key = self._key(namespace, version)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return True, self.memory[key]
+        if self.disk_dir:
+            found, value = self._load_from_disk(key, validate)
+            if found:
+                self._remember(key, value)
+                return True, value
+        return False, None
+    
+    def get_or_compute(self, namespace, version, compute, validate=None):
+        """Return the cached artifact for ``(namespace, version)``, building it if needed"""
+        found, value = self.get(namespace, version, validate)
+        if found:
+            return value
+        value = compute()
+        key = self._key(namespace, version)
+        self._remember(key, value)
+        if self.disk_dir:
+            self._write_to_disk(key, value)
+        return value
+
+# Shared state backend - set to enable multi-worker mode
+STATE_DB_PATH = os.environ.get('EHR_STATE_DB')
+
+@st.cache_resource
+def get_artifact_cache():
+    """Return the shared artifact cache (disk-backed when EHR_CACHE_DIR is set)
+
+    In multi-worker mode the cache defaults to a directory next to the
+    state database, so all workers share derived artifacts.
+    """
+    disk_dir = os.environ.get('EHR_CACHE_DIR')
+    if disk_dir is None and STATE_DB_PATH:
+        disk_dir = os.path.join(os.path.dirname(os.path.abspath(STATE_DB_PATH)), 'artifact_cache')
+    return ArtifactCache(disk_dir=disk_dir)
+
 def get_plan_type_color(plan_type):
     """Return color for plan type badge"""
     colors = {
@@ -558,6 +767,1701 @@ def get_reimbursement_color(model):
     }
     return colors.get(model, '#6b7280')
 
+def get_case_bank():
+    """Return the shared case bank indexes for the current case content"""
+    return load_case_bank(CASE_BANK_VERSION)
+
+@st.cache_resource
+def load_case_bank(version):
+    """Build the case bank once per content version"""
+    return get_artifact_cache().get_or_compute(
+        'case-bank', version, lambda: build_case_bank(LEARNING_CASES), is_case_bank)
+
+def build_case_bank(cases):
+    """Build lookup indexes over the learning case bank
+
+    Cases are indexed by id, by patient and by topic tag. Each index keeps
+    the original bank order, so per-patient and per-topic case lists are
+    stable across reruns.
+    """
+    bank = {'cases': {}, 'by_patient': {}, 'by_topic': {}}
+    for case in cases:
+        bank['cases'][case['id']] = case
+        bank['by_patient'].setdefault(case['patientId'], []).append(case['id'])
+        for topic in case.get('topics', []):
+            bank['by_topic'].setdefault(topic, []).append(case['id'])
+    return bank
+
+def is_case_bank(value):
+    """Return True if a cached value has the case bank's structure"""
+    return isinstance(value, dict) and {'cases', 'by_patient', 'by_topic'} <= value.keys()
+
+def get_patient_cases(patient_id):
+    """Return the learning cases for a patient in bank order"""
+    bank = get_case_bank()
+    return [bank['cases'][case_id] for case_id in bank['by_patient'].get(patient_id, [])]
+
+def topic_mastery_score(topic):
+    """Return the smoothed accuracy for a topic (0.5 when unseen)"""
+    stats = st.session_state.topic_mastery.get(topic, {'correct': 0, 'attempts': 0})
+    return (stats['correct'] + 1) / (stats['attempts'] + 2)
+
+def record_topic_result(case, is_correct):
+    """Update the student's mastery vector after answering a case"""
+    for topic in case.get('topics', []):
+        stats = st.session_state.topic_mastery.setdefault(topic, {'correct': 0, 'attempts': 0})
+        stats['attempts'] += 1
+        if is_correct:
+            stats['correct'] += 1
+        if st.session_state.topic_heap is not None:
+            heapq.heappush(st.session_state.topic_heap, (topic_mastery_score(topic), topic))
+
+def next_open_case_in_topic(topic):
+    """Return the first unfinished case id for a topic, advancing its cursor"""
+    case_ids = get_case_bank()['by_topic'].get(topic, [])
+    cursor = st.session_state.topic_cursor.get(topic, 0)
+    while cursor < len(case_ids) and case_ids[cursor] in st.session_state.completed_cases:
+        cursor += 1
+    st.session_state.topic_cursor[topic] = cursor
+    return case_ids[cursor] if cursor < len(case_ids) else None
+
+def open_case(case):
+    """Switch to practice mode on a case's patient with the case expanded
+
+    Used as a button callback, so the mode radio can still be changed
+    before it is rendered on the next run.
+    """
+    st.session_state.app_mode = "Practice"
+    st.session_state.selected_patient = next(p for p in PATIENTS if p['id'] == case['patientId'])
+    st.session_state.focus_case = case['id']
+
+def select_next_case():
+    """Pick the next unfinished case from the student's weakest topic
+
+    Topics sit in a min-heap keyed on mastery score. Updates push a fresh
+    entry instead of re-heapifying, so stale entries are discarded lazily
+    when they reach the top. Together with the per-topic cursors this keeps
+    selection at O(log n) regardless of the bank size.
+    """
+    bank = get_case_bank()
+    if st.session_state.topic_heap is None:
+        st.session_state.topic_heap = [(topic_mastery_score(t), t) for t in bank['by_topic']]
+        heapq.heapify(st.session_state.topic_heap)
+
+    heap = st.session_state.topic_heap
+    while heap:
+        score, topic = heap[0]
+        if score != topic_mastery_score(topic):
+            heapq.heappop(heap)  # Stale entry from an earlier answer
+            continue
+        case_id = next_open_case_in_topic(topic)
+        if case_id is None:
+            heapq.heappop(heap)  # Every case in this topic is done
+            continue
+        return bank['cases'][case_id], topic
+    return None, None
+
+# Relative weight of each searchable field when ranking results
+SEARCH_FIELD_WEIGHTS = {
+    'name': 5.0,
+    'insurance': 3.0,
+    'diagnosis': 2.0,
+    'medication': 2.0,
+    'claim_service': 1.5,
+    'claim_status': 1.5,
+    'case_title': 2.0,
+    'case_scenario': 1.0,
+    'case_explanation': 0.5
+}
+PREFIX_MATCH_PENALTY = 0.7
+
+def tokenize(text):
+    """Split text into lowercase alphanumeric search terms"""
+    return re.findall(r"[a-z0-9]+", str(text).lower())
+
+def patient_search_fields(patient, cases):
+    """Collect the searchable text of a patient record and its cases by field"""
+    insurance = patient['insurance']
+    return {
+        'name': [patient['name'], patient['mrn']],
+        'insurance': [insurance['primary'], insurance['planType'], insurance['reimbursementModel']],
+        'diagnosis': patient['diagnosis'],
+        'medication': patient['medications'],
+        'claim_service': [c['service'] for c in patient['claims']],
+        'claim_status': [c['status'] for c in patient['claims']],
+        'case_title': [c['title'] for c in cases] + [t for c in cases for t in c.get('topics', [])],
+        'case_scenario': [c['scenario'] for c in cases],
+        'case_explanation': [c['explanation'] for c in cases]
+    }
+
+class SearchIndex:
+    """Inverted index over patient records, claims and learning cases
+
+    Each patient is one document. Postings map a term to the weighted
+    term frequency per document, and a sorted vocabulary supports prefix
+    lookups with bisect. Documents are re-indexed only when their content
+    version changes, so syncing after a data change is incremental; the
+    vocabulary is re-sorted once per sync, not once per new term.
+    """
+    
+    def __init__(self):
+        self.postings = {}
+        self.doc_terms = {}
+        self.doc_signatures = {}
+        self.vocabulary = []
+        self.vocabulary_dirty = False
+        self.dataset_version = None
+        self.lock = threading.Lock()
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+    
+    def _add_document(self, doc_id, fields):
+        terms = {}
+        for field, values in fields.items():
+            weight = SEARCH_FIELD_WEIGHTS[field]
+            for value in values:
+                for term in tokenize(value):
+                    terms[term] = terms.get(term, 0.0) + weight
+        for term, weight in terms.items():
+            if term not in self.postings:
+                self.postings[term] = {}
+                self.vocabulary_dirty = True
+            self.postings[term][doc_id] = weight
+        self.doc_terms[doc_id] = terms
+    
+    def _remove_document(self, doc_id):
+        for term in self.doc_terms.pop(doc_id, {}):
+            docs = self.postings[term]
+            docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[term]
+                self.vocabulary_dirty = True
+        self.doc_signatures.pop(doc_id, None)
+    
+    def sync(self, versions, load_fields):
+        """Bring the index up to date with ``{doc_id: version}``
+
+        ``load_fields(doc_id)`` is only called for new or changed documents.
+        """
+        with self.lock:
+            for doc_id in set(self.doc_signatures) - set(versions):
+                self._remove_document(doc_id)
+            for doc_id, version in versions.items():
+                if self.doc_signatures.get(doc_id) == version:
+                    continue
+                self._remove_document(doc_id)
+                self._add_document(doc_id, load_fields(doc_id))
+                self.doc_signatures[doc_id] = version
+            if self.vocabulary_dirty:
+                self.vocabulary = sorted(self.postings)
+                self.vocabulary_dirty = False
+    
+    def _expand(self, token):
+        """Return (term, factor) pairs for an exact or prefix match"""
+        matches = []
+        start = bisect.bisect_left(self.vocabulary, token)
+        for term in self.vocabulary[start:]:
+            if not term.startswith(token):
+                break
+            matches.append((term, 1.0 if term == token else PREFIX_MATCH_PENALTY))
+        return matches
+    
+    def search(self, query):
+        """Return doc ids matching every query term, best match first"""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self.lock:
+            total_docs = max(len(self.doc_terms), 1)
+            scores = None
+            for token in tokens:
+                token_scores = {}
+                for term, factor in self._expand(token):
+                    docs = self.postings[term]
+                    idf = math.log(1 + total_docs / len(docs))
+                    for doc_id, weight in docs.items():
+                        score = weight * idf * factor
+                        if score > token_scores.get(doc_id, 0.0):
+                            token_scores[doc_id] = score
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {doc_id: scores[doc_id] + score
+                              for doc_id, score in token_scores.items() if doc_id in scores}
+                if not scores:
+                    return []
+        return sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))
+
+def patient_content_version(patient_id):
+    """Return the combined content version of a patient and their cases"""
+    case_ids = get_case_bank()['by_patient'].get(patient_id, [])
+    return content_hash([PATIENT_VERSIONS[patient_id]] + [CASE_VERSIONS[c] for c in case_ids])
+
+def build_search_index():
+    """Build a search index over the current data set"""
+    index = SearchIndex()
+    sync_search_index(index)
+    return index
+
+def sync_search_index(index):
+    """Re-index patients whose content version changed
+
+    Does nothing when the index was already synced against the current
+    data set, so per-query calls cost a single comparison.
+    """
+    if index.dataset_version == DATASET_VERSION:
+        return
+    patients_by_id = {p['id']: p for p in PATIENTS}
+    index.sync(
+        {p['id']: patient_content_version(p['id']) for p in PATIENTS},
+        lambda patient_id: patient_search_fields(patients_by_id[patient_id], get_patient_cases(patient_id))
+    )
+    index.dataset_version = DATASET_VERSION
+
+@st.cache_resource
+def get_search_index():
+    """Return the shared search index, reusing a persisted one when available"""
+    return get_artifact_cache().get_or_compute(
+        'search-index', DATASET_VERSION, build_search_index,
+        lambda value: isinstance(value, SearchIndex) and hasattr(value, 'dataset_version'))
+
+def search_patients(query):
+    """Return patients matching a full-text query, ranked by relevance"""
+    index = get_search_index()
+    sync_search_index(index)
+    patients_by_id = {p['id']: p for p in PATIENTS}
+    return [patients_by_id[doc_id] for doc_id in index.search(query)]
+
+# X12 claim (837) and remittance (835) import
+X12_CHUNK_SIZE = 1 << 16
+
+# Claim Adjustment Reason Codes (CARC) used in the training files
+CARC_DESCRIPTIONS = {
+    '1': 'Deductible',
+    '2': 'Coinsurance',
+    '3': 'Copay',
+    '27': 'Coverage terminated',
+    '29': 'Timely filing limit expired',
+    '40': 'Non-emergency',
+    '45': 'Exceeds fee schedule',
+    '50': 'Not medically necessary',
+    '96': 'Non-covered charge',
+    '97': 'Bundled with another service',
+    '197': 'Precertification/authorization absent',
+    '242': 'Referral/network provider required'
+}
+
+X12_CODE_QUALIFIERS = {'HC': 'CPT', 'NU': 'Rev', 'N4': 'NDC', 'AD': 'ADA'}
+
+def iter_x12_segments(stream, chunk_size=X12_CHUNK_SIZE):
+    """Yield X12 segments as element lists from a binary stream
+
+    Separators are taken from the fixed-width ISA header, and the stream
+    is read in chunks so memory use does not grow with the file size.
+    """
+    header = stream.read(106).lstrip()
+    if not header.startswith(b'ISA') or len(header) < 106:
+        raise ValueError("Not an X12 interchange: missing ISA header")
+    element_sep = header[3:4].decode('ascii')
+    segment_term = header[105:106]
+    
+    buffer = header
+    while True:
+        *segments, buffer = buffer.split(segment_term)
+        for raw in segments:
+            raw = raw.strip()
+            if raw:
+                yield raw.decode('ascii', 'replace').split(element_sep)
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+    if buffer.strip():
+        yield buffer.strip().decode('ascii', 'replace').split(element_sep)
+
+def x12_element(segment, position, default=''):
+    """Return an element by X12 position (1-based), or a default"""
+    return segment[position] if len(segment) > position and segment[position] else default
+
+def x12_amount(value):
+    """Parse an X12 monetary amount, keeping whole dollars as int"""
+    amount = float(value or 0)
+    return int(amount) if amount.is_integer() else amount
+
+def x12_date(value):
+    """Convert CCYYMMDD (or a CCYYMMDD-CCYYMMDD range) to ISO format"""
+    value = value.split('-')[0]
+    return f"{value[:4]}-{value[4:6]}-{value[6:8]}" if len(value) == 8 else value
+
+def x12_service(composite, component_sep=':'):
+    """Describe a procedure composite such as HC:99283"""
+    parts = composite.split(component_sep)
+    if len(parts) < 2:
+        return composite
+    return f"{X12_CODE_QUALIFIERS.get(parts[0], parts[0])} {parts[1]}"
+
+def remittance_status(claim_status, adjustments, paid):
+    """Build a claim status string from CLP02 and CAS adjustments"""
+    if claim_status == '4' or (paid == 0 and any(group != 'PR' for group, _ in adjustments)):
+        reasons = [CARC_DESCRIPTIONS.get(code, f"CARC {code}") for group, code in adjustments if group != 'PR']
+        return f"DENIED - {reasons[0]}" if reasons else "DENIED"
+    patient_reasons = [CARC_DESCRIPTIONS.get(code, f"CARC {code}") for group, code in adjustments if group == 'PR']
+    if patient_reasons:
+        return "Paid - " + ", ".join(patient_reasons) + " applied"
+    return "Paid"
+
+def parse_x12(stream):
+    """Stream claim records out of an X12 837 or 835 file
+
+    Each service line becomes one record in the app's claim format (date,
+    service, amount, paid, status) plus the claim id, member id and patient
+    name used to match it to a patient. 837 lines have no payment yet; 835
+    lines carry the payer's paid amount and adjustment reasons. Claims
+    without service lines become a single claim-level record.
+    """
+    transaction = None
+    component_sep = ':'
+    subscriber = {'member_id': '', 'patient_name': ''}
+    claim = None
+    line = None
+    
+    def finish_line():
+        if line is None:
+            return None
+        claim['lines'] += 1
+        return claim_record(claim, transaction, line)
+    
+    def finish_claim():
+        record = finish_line()
+        if record is None and claim is not None and claim['lines'] == 0:
+            record = claim_record(claim, transaction)
+        return record
+    
+    for segment in iter_x12_segments(stream):
+        tag = segment[0]
+        if tag == 'ISA':
+            component_sep = x12_element(segment, 16, ':')
+        elif tag == 'ST':
+            transaction = x12_element(segment, 1)
+        elif tag == 'NM1' and x12_element(segment, 1) in ('IL', 'QC'):
+            person = {
+                'member_id': x12_element(segment, 9),
+                'patient_name': f"{x12_element(segment, 4)} {x12_element(segment, 3)}".strip().title()
+            }
+            if transaction == '835' and claim is not None:
+                claim.update(person)
+            else:
+                subscriber = person
+        elif tag in ('CLM', 'CLP'):
+            record = finish_claim()
+            if record:
+                yield record
+            line = None
+            is_remittance = tag == 'CLP'
+            claim = {
+                'claim_id': x12_element(segment, 1),
+                'status_code': x12_element(segment, 2) if is_remittance else '',
+                'amount': x12_amount(x12_element(segment, 3 if is_remittance else 2)),
+                'paid': x12_amount(x12_element(segment, 4)) if is_remittance else 0,
+                'date': '',
+                'adjustments': [],
+                'lines': 0,
+                **subscriber
+            }
+        elif claim is None:
+            continue
+        elif tag in ('SVC', 'SV1', 'SV2'):
+            record = finish_line()
+            if record:
+                yield record
+            if tag == 'SV2':
+                composite, amount, paid = x12_element(segment, 2), x12_element(segment, 3), ''
+            else:
+                composite, amount = x12_element(segment, 1), x12_element(segment, 2)
+                paid = x12_element(segment, 3) if tag == 'SVC' else ''
+            line = {
+                'service': x12_service(composite, component_sep),
+                'amount': x12_amount(amount),
+                'paid': x12_amount(paid),
+                'date': '',
+                'adjustments': []
+            }
+        elif tag in ('DTM', 'DTP'):
+            # Service date (837 DTP*472, 835 DTM*472/150/232)
+            if x12_element(segment, 1) in ('472', '150', '232'):
+                target = line if line is not None else claim
+                target['date'] = x12_date(x12_element(segment, 3 if tag == 'DTP' else 2))
+        elif tag == 'CAS':
+            target = line if line is not None else claim
+            group = x12_element(segment, 1)
+            # Reason/amount/quantity triplets start at CAS02
+            for position in range(2, len(segment), 3):
+                if segment[position]:
+                    target['adjustments'].append((group, segment[position]))
+        elif tag == 'SE':
+            record = finish_claim()
+            if record:
+                yield record
+            claim, line = None, None
+    
+    record = finish_claim()
+    if record:
+        yield record
+
+def claim_record(claim, transaction, line=None):
+    """Build an app claim record from a parsed claim and optional service line"""
+    source = line if line is not None else claim
+    if transaction == '835':
+        adjustments = source['adjustments'] or claim['adjustments']
+        status = remittance_status(claim['status_code'], adjustments, source['paid'])
+    else:
+        status = 'Submitted - awaiting remittance'
+    return {
+        'date': source['date'] or claim['date'],
+        'service': line['service'] if line is not None else f"Claim {claim['claim_id']}",
+        'amount': source['amount'],
+        'paid': source['paid'],
+        'status': status,
+        'claim_id': claim['claim_id'],
+        'member_id': claim['member_id'],
+        'patient_name': claim['patient_name'],
+        'transaction': transaction
+    }
+
+def match_claims_to_patient(records, patient):
+    """Return the imported records that belong to a patient
+
+    ``records`` may be the ``parse_x12`` generator, so only the matching
+    records are ever held in memory.
+    """
+    member_id = patient['insurance'].get('memberID')
+    name = patient['name'].lower()
+    return [r for r in records
+            if (member_id and r['member_id'] == member_id) or r['patient_name'].lower() == name]
+
+# Claim rule engine - keyword classifiers (first match wins). Keywords are
+# regex fragments matched from the start of a word; abbreviations end in \b
+SERVICE_CATEGORIES = [
+    ('emergency', ['emergency', r'er\b']),
+    ('preventive', ['wellness', 'screening', 'preventive']),
+    ('inpatient', ['hospital stay', 'catheterization', 'appendectomy', 'surgery']),
+    ('imaging', ['mri', r'ct\b', 'ultrasound', 'mammography', 'x-ray']),
+    ('lab', ['lab']),
+    ('pharmacy', ['drug', 'injection', 'prescription', 'generic', 'supply', 'vitamins']),
+    ('specialist', ['consult', 'cardiology', 'rheumatology', r'gi\b', 'specialist', 'psychotherapy',
+                    'mental health', 'surgical visit']),
+    ('primary_care', ['pcp', 'primary care', 'visit', 'office'])
+]
+DIAGNOSIS_CATEGORIES = [
+    ('acute_cardiac', ['stemi', 'acute mi', 'myocardial infarction', 'chest pain']),
+    ('trauma', ['fracture', 'trauma', 'laceration']),
+    ('acute_surgical', ['acute appendicitis', 'appendectomy']),
+    ('pregnancy', ['pregnan', 'prenatal']),
+    ('mental_health', ['anxiety', 'depress', 'stress disorder', 'adjustment disorder'])
+]
+EMERGENCY_DIAGNOSES = ['acute_cardiac', 'trauma', 'acute_surgical', 'pregnancy']
+MANAGED_CARE_PLANS = ['HMO', 'Managed Care', 'Medicaid Managed Care']
+
+# Declarative payer rules; the highest-priority matching rule decides.
+# Omitted conditions match anything ('*' for plan types and services).
+CLAIM_RULES = [
+    {'id': 'MC-ER-01', 'plan_types': MANAGED_CARE_PLANS, 'service': 'emergency',
+     'diagnosis_none': EMERGENCY_DIAGNOSES, 'decision': 'deny', 'reason_code': '40', 'priority': 100},
+    {'id': 'MC-REF-01', 'plan_types': MANAGED_CARE_PLANS, 'service': 'specialist',
+     'requires': 'referral', 'decision': 'deny', 'reason_code': '242', 'priority': 90},
+    {'id': 'MC-AUTH-01', 'plan_types': MANAGED_CARE_PLANS, 'service': 'inpatient',
+     'requires': 'prior_auth', 'diagnosis_none': EMERGENCY_DIAGNOSES,
+     'decision': 'pend', 'reason_code': '197', 'priority': 80},
+    {'id': 'PREV-01', 'plan_types': '*', 'service': 'preventive',
+     'decision': 'approve', 'reason_code': '', 'priority': 50},
+    {'id': 'DEFAULT', 'plan_types': '*', 'service': '*',
+     'decision': 'approve', 'reason_code': '', 'priority': 0}
+]
+CLAIM_FLAGS = ['referral', 'prior_auth']
+CLAIM_RULES_VERSION = content_hash([CLAIM_RULES, SERVICE_CATEGORIES, DIAGNOSIS_CATEGORIES])
+
+def keywords_match(keywords, text):
+    """Return True if any keyword starts at a word boundary in the text"""
+    return re.search(r"\b(?:" + "|".join(keywords) + ")", text) is not None
+
+def classify_text(text, categories, default=None):
+    """Return the first category whose keywords appear in the text"""
+    text = text.lower()
+    for category, keywords in categories:
+        if keywords_match(keywords, text):
+            return category
+    return default
+
+def diagnosis_mask(diagnoses):
+    """Encode the diagnosis categories present in a diagnosis string as a bitmask"""
+    text = diagnoses.lower() if isinstance(diagnoses, str) else '; '.join(diagnoses).lower()
+    mask = 0
+    for bit, (_, keywords) in enumerate(DIAGNOSIS_CATEGORIES):
+        if keywords_match(keywords, text):
+            mask |= 1 << bit
+    return mask
+
+def compile_claim_rules(rules):
+    """Compile declarative rules into a decision table keyed by (plan type, service)
+
+    Wildcard rules are stored under '*' keys and merged into concrete keys
+    lazily, so a lookup touches only the few rules that can apply to a
+    (plan type, service) pair. Diagnosis and flag conditions become
+    bitmasks, so checking a rule is a couple of integer operations.
+    """
+    dx_bits = {category: 1 << bit for bit, (category, _) in enumerate(DIAGNOSIS_CATEGORIES)}
+    flag_bits = {flag: 1 << bit for bit, flag in enumerate(CLAIM_FLAGS)}
+    table = {}
+    for rule in rules:
+        compiled = {
+            'id': rule['id'],
+            'priority': rule.get('priority', 0),
+            'decision': rule['decision'],
+            'reason_code': rule.get('reason_code', ''),
+            'dx_any': sum(dx_bits[c] for c in rule.get('diagnosis_any', [])),
+            'dx_none': sum(dx_bits[c] for c in rule.get('diagnosis_none', [])),
+            'requires': flag_bits[rule['requires']] if 'requires' in rule else 0
+        }
+        plan_types = rule.get('plan_types', '*')
+        for plan_type in ([plan_types] if plan_types == '*' else plan_types):
+            table.setdefault((plan_type, rule.get('service', '*')), []).append(compiled)
+    return {'table': table, 'merged': {}, 'flag_bits': flag_bits}
+
+def candidate_rules(ruleset, plan_type, service_category):
+    """Return the rules that can apply to a (plan type, service) pair, best first"""
+    key = (plan_type, service_category)
+    if key not in ruleset['merged']:
+        table = ruleset['table']
+        rules = (table.get(key, []) + table.get((plan_type, '*'), []) +
+                 table.get(('*', service_category), []) + table.get(('*', '*'), []))
+        ruleset['merged'][key] = sorted(rules, key=lambda r: -r['priority'])
+    return ruleset['merged'][key]
+
+def decide(ruleset, plan_type, service_category, dx_mask, flag_mask):
+    """Return the first matching compiled rule for an encoded claim"""
+    for rule in candidate_rules(ruleset, plan_type, service_category):
+        if rule['dx_any'] and not dx_mask & rule['dx_any']:
+            continue
+        if dx_mask & rule['dx_none']:
+            continue
+        if rule['requires'] and (flag_mask & rule['requires']) == rule['requires']:
+            continue  # Requirement satisfied - rule does not fire
+        return rule
+    return None
+
+def claim_decision_label(rule):
+    """Describe a rule decision the way claim statuses are written"""
+    if rule is None or rule['decision'] == 'approve':
+        return 'Approved'
+    reason = CARC_DESCRIPTIONS.get(rule['reason_code'], f"CARC {rule['reason_code']}")
+    return f"{'DENIED' if rule['decision'] == 'deny' else 'PENDED'} - {reason}"
+
+@st.cache_resource
+def get_claim_ruleset(version=None):
+    """Return the compiled claim rules for the given rules version"""
+    return compile_claim_rules(CLAIM_RULES)
+
+def evaluate_claims(claims_df, ruleset=None):
+    """Evaluate a frame of claims against the rule set
+
+    ``claims_df`` needs ``plan_type``, ``service`` and ``diagnosis``
+    columns, plus optional boolean ``referral``/``prior_auth`` columns.
+    Claims are encoded to integer keys and rules run once per distinct
+    key, then broadcast back, so a million claims cost only as much as
+    their distinct (plan, service, diagnosis, flags) combinations.
+    Adds ``decision``, ``reason_code``, ``rule_id`` and ``decision_label``.
+    """
+    ruleset = ruleset or get_claim_ruleset(CLAIM_RULES_VERSION)
+    
+    # Missing values become '' so factorize never returns its -1 sentinel,
+    # which would corrupt the packed keys below
+    plan_codes, plans = pd.factorize(claims_df['plan_type'].fillna(''))
+    service_codes, services = pd.factorize(claims_df['service'].fillna(''))
+    categories = [classify_text(service, SERVICE_CATEGORIES, 'other') for service in services]
+    dx_codes, diagnoses = pd.factorize(claims_df['diagnosis'].fillna(''))
+    dx_masks = np.array([diagnosis_mask(d) for d in diagnoses], dtype=np.int64)
+    
+    flag_mask = np.zeros(len(claims_df), dtype=np.int64)
+    for flag, bit in ruleset['flag_bits'].items():
+        if flag in claims_df:
+            flag_mask |= claims_df[flag].fillna(False).astype(bool).to_numpy() * bit
+    
+    # Pack the four codes into one int64 key and hash-factorize it
+    flag_count = 1 << len(ruleset['flag_bits'])
+    keys = ((plan_codes.astype(np.int64) * len(services) + service_codes) * len(diagnoses) + dx_codes) * flag_count + flag_mask
+    inverse, unique_keys = pd.factorize(keys)
+    
+    decisions, reason_codes, rule_ids, labels = [], [], [], []
+    for key in unique_keys:
+        key, flags = divmod(int(key), flag_count)
+        key, dx_code = divmod(key, len(diagnoses))
+        plan_code, service_code = divmod(key, len(services))
+        rule = decide(ruleset, plans[plan_code], categories[service_code], dx_masks[dx_code], flags)
+        decisions.append(rule['decision'] if rule else 'approve')
+        reason_codes.append(rule['reason_code'] if rule else '')
+        rule_ids.append(rule['id'] if rule else '')
+        labels.append(claim_decision_label(rule))
+    
+    result = claims_df.copy()
+    result['decision'] = np.array(decisions, dtype=object)[inverse]
+    result['reason_code'] = np.array(reason_codes, dtype=object)[inverse]
+    result['rule_id'] = np.array(rule_ids, dtype=object)[inverse]
+    result['decision_label'] = np.array(labels, dtype=object)[inverse]
+    return result
+
+def patient_claims_frame(patient):
+    """Return a patient's claims in the rule engine's input format"""
+    claims_df = pd.DataFrame(patient['claims'])
+    claims_df['plan_type'] = patient['insurance']['planType']
+    claims_df['diagnosis'] = '; '.join(patient['diagnosis'])
+    return claims_df
+
+def build_denial_case(patient, claim):
+    """Generate a learning case from a rule engine denial or pend"""
+    reason = CARC_DESCRIPTIONS.get(claim['reason_code'], f"CARC {claim['reason_code']}")
+    distractors = [r for code, r in CARC_DESCRIPTIONS.items()
+                   if code != claim['reason_code'] and code not in ('1', '2', '3')]
+    rng = random.Random(f"{patient['id']}:{claim['service']}:{claim['rule_id']}")
+    options = rng.sample(distractors, 3) + [reason]
+    rng.shuffle(options)
+    verb = 'denied' if claim['decision'] == 'deny' else 'pended'
+    return {
+        'id': f"gen-{content_hash([patient['id'], claim['service'], claim['rule_id']])[:8]}",
+        'patientId': patient['id'],
+        'topics': ['claim-denials'],
+        'title': f"Claim {verb.title()}: {claim['service']}",
+        'objective': 'Identify why a payer denies or pends a claim',
+        'scenario': (f"{patient['name']}'s {patient['insurance']['planType']} plan {verb} a "
+                     f"${claim['amount']:,} claim for {claim['service']}."),
+        'question': 'Which claim adjustment reason best explains this decision?',
+        'options': options,
+        'correct': options.index(reason),
+        'explanation': (f"Rule {claim['rule_id']} applies to {patient['insurance']['planType']} plans: "
+                        f"the claim was {verb} with reason code {claim['reason_code']} ({reason}).")
+    }
+
+def generate_denial_cases(patients):
+    """Generate learning cases for every claim the rule engine denies or pends"""
+    cases = []
+    for patient in patients:
+        if not patient['claims']:
+            continue
+        evaluated = evaluate_claims(patient_claims_frame(patient))
+        for claim in evaluated[evaluated['decision'] != 'approve'].to_dict('records'):
+            cases.append(build_denial_case(patient, claim))
+    return cases
+
+@st.cache_resource
+def load_denial_cases(version):
+    """Generate the rule engine's denial cases once per patient data and rules version"""
+    return get_artifact_cache().get_or_compute(
+        'denial-cases', version, lambda: generate_denial_cases(PATIENTS),
+        lambda value: isinstance(value, list) and all(isinstance(case, dict) for case in value))
+
+# Content versions - derived artifacts are cached under these keys, so any
+# edit to a patient or case invalidates exactly the artifacts built from it.
+# Denials found by the rule engine join the case bank as generated cases.
+PATIENT_VERSIONS = {p['id']: content_hash(p) for p in PATIENTS}
+LEARNING_CASES.extend(load_denial_cases(content_hash([PATIENT_VERSIONS, CLAIM_RULES_VERSION])))
+CASE_VERSIONS = {c['id']: content_hash(c) for c in LEARNING_CASES}
+CASE_BANK_VERSION = content_hash(CASE_VERSIONS)
+DATASET_VERSION = content_hash([PATIENT_VERSIONS, CASE_VERSIONS])
+
+# Display columns for the claims tables: {source column: header}
+CLAIMS_DISPLAY_COLUMNS = {
+    'date': 'Date',
+    'service': 'Service Description',
+    'amount': 'Billed Amount ($)',
+    'paid': 'Insurance Paid ($)',
+    'patient_responsibility': 'Patient Owes ($)',
+    'status': 'Claim Status'
+}
+RULE_CHECK_DISPLAY_COLUMNS = {
+    'service': 'Service Description',
+    'status': 'Recorded Status',
+    'decision_label': 'Rule Engine Decision',
+    'rule_id': 'Rule'
+}
+PRICING_DISPLAY_COLUMNS = {
+    'service': 'Service Description',
+    'code': 'Code',
+    'amount': 'Billed Amount ($)',
+    'allowed': 'Medicare Allowed ($)',
+    'medicare_paid': 'Medicare Pays ($)',
+    'paid': 'Recorded Paid ($)'
+}
+DICTIONARY_ENCODED_COLUMNS = ['service', 'status', 'decision_label', 'rule_id', 'code']
+CLAIMS_PAGE_SIZE = 500
+
+def to_arrow_table(df):
+    """Convert a DataFrame to Arrow with repetitive text columns dictionary-encoded"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for name in DICTIONARY_ENCODED_COLUMNS:
+        if name in table.column_names:
+            position = table.column_names.index(name)
+            table = table.set_column(position, name, pc.dictionary_encode(table[name]))
+    return table
+
+def arrow_display_view(table, columns):
+    """Select and rename columns for display without copying column buffers"""
+    return table.select(list(columns)).rename_columns(list(columns.values()))
+
+def render_arrow_table(table, key, **kwargs):
+    """Show an Arrow table, paging through zero-copy slices when it is large"""
+    if table.num_rows > CLAIMS_PAGE_SIZE:
+        pages = (table.num_rows - 1) // CLAIMS_PAGE_SIZE + 1
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=key)
+        table = table.slice((page - 1) * CLAIMS_PAGE_SIZE, CLAIMS_PAGE_SIZE)
+    st.dataframe(table, use_container_width=True, **kwargs)
+
+def build_claims_artifacts(patient):
+    """Build the claims table, totals and chart for a patient"""
+    claims_df = pd.DataFrame(patient['claims'])
+    claims_df['patient_responsibility'] = claims_df['amount'] - claims_df['paid']
+    
+    fig = px.bar(
+        claims_df, 
+        x='service', 
+        y=['amount', 'paid'], 
+        title='Claims Overview: Billed vs Paid Amounts',
+        barmode='group',
+        color_discrete_map={'amount': '#ef4444', 'paid': '#10b981'}
+    )
+    fig.update_layout(xaxis_tickangle=-45, height=400)
+    
+    return {
+        'display_table': arrow_display_view(to_arrow_table(claims_df), CLAIMS_DISPLAY_COLUMNS),
+        'totals': {
+            'amount': float(claims_df['amount'].sum()),
+            'paid': float(claims_df['paid'].sum()),
+            'patient_responsibility': float(claims_df['patient_responsibility'].sum())
+        },
+        'figure': fig
+    }
+
+def build_patient_views(patient, ruleset, pricing_tables):
+    """Build every derived claims view for a patient (safe to run off the script thread)"""
+    rule_check = evaluate_claims(patient_claims_frame(patient), ruleset)
+    pricing = get_medicare_pricing(patient, pricing_tables)
+    priced, unpriced_codes = pricing if pricing is not None else (None, [])
+    return {
+        'claims': build_claims_artifacts(patient),
+        'rule_check': arrow_display_view(
+            to_arrow_table(rule_check[list(RULE_CHECK_DISPLAY_COLUMNS)]), RULE_CHECK_DISPLAY_COLUMNS),
+        'pricing': None if priced is None else arrow_display_view(
+            to_arrow_table(priced[list(PRICING_DISPLAY_COLUMNS)]), PRICING_DISPLAY_COLUMNS),
+        'unpriced_codes': unpriced_codes
+    }
+
+def is_patient_views(value):
+    """Return True if a cached value has the structure build_patient_views returns"""
+    return (isinstance(value, dict) and {'claims', 'rule_check', 'pricing', 'unpriced_codes'} <= value.keys()
+            and isinstance(value['claims'], dict)
+            and {'display_table', 'totals', 'figure'} <= value['claims'].keys())
+
+# Background warming of patient views
+PRECOMPUTE_WORKERS = 2
+PRECOMPUTE_MAX_PENDING = 16
+PRECOMPUTE_PAGE_SIZE = 10
+PRECOMPUTE_POLL_SECONDS = 1.0
+
+class PrecomputePool:
+    """Thread pool that builds patient views ahead of the foreground rerun
+
+    Each requested artifact key is owned by the sessions that asked for
+    it. When a session's selection changes, its claims on other keys are
+    released and work nobody wants any more is cancelled if it has not
+    started. At most ``max_pending`` jobs are queued; extra requests are
+    skipped and computed on demand instead.
+    """
+    
+    def __init__(self, max_workers=PRECOMPUTE_WORKERS, max_pending=PRECOMPUTE_MAX_PENDING):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ehr-precompute')
+        self.max_pending = max_pending
+        self.futures = {}
+        self.owners = {}
+        self.lock = threading.Lock()
+    
+    def submit(self, owner, key, compute):
+        """Queue ``compute`` under ``key`` for an owner; return its future, or None if the queue is full"""
+        created = False
+        with self.lock:
+            future = self.futures.get(key)
+            if future is None or future.cancelled():
+                pending = sum(1 for f in self.futures.values() if not f.done())
+                if pending >= self.max_pending:
+                    return None
+                future = self.executor.submit(compute)
+                self.futures[key] = future
+                created = True
+            self.owners.setdefault(key, set()).add(owner)
+        if created:
+            # May run immediately on this thread if the job already finished
+            future.add_done_callback(lambda f: self._forget(key, f))
+        return future
+    
+    def retain(self, owner, keys):
+        """Drop an owner's interest in every key not in ``keys`` and cancel orphaned work"""
+        keys = set(keys)
+        orphaned = []
+        with self.lock:
+            for key, owners in list(self.owners.items()):
+                if key in keys or owner not in owners:
+                    continue
+                owners.discard(owner)
+                if not owners and key in self.futures:
+                    orphaned.append(self.futures[key])
+        # Cancelling runs done-callbacks synchronously, so do it outside the lock
+        for future in orphaned:
+            future.cancel()
+    
+    def _forget(self, key, future):
+        # Finished results live in the artifact cache, so the future can go
+        with self.lock:
+            if self.futures.get(key) is future:
+                del self.futures[key]
+                self.owners.pop(key, None)
+
+@st.cache_resource
+def get_precompute_pool():
+    """Return the shared background precompute pool"""
+    return PrecomputePool()
+
+def patient_views_version(patient):
+    """Return the version of a patient's views (content, rules and pricing tables)"""
+    return content_hash([PATIENT_VERSIONS[patient['id']], CLAIM_RULES_VERSION, PRICING_VERSION])
+
+def patient_views_job(patient):
+    """Return a callable that builds and caches a patient's views in the background
+
+    Shared resources are resolved here on the script thread, so the
+    worker never touches Streamlit APIs.
+    """
+    cache = get_artifact_cache()
+    ruleset = get_claim_ruleset(CLAIM_RULES_VERSION)
+    pricing_tables = load_pricing_tables(PRICING_VERSION)
+    version = patient_views_version(patient)
+    return lambda: cache.get_or_compute(
+        'patient-views', version, lambda: build_patient_views(patient, ruleset, pricing_tables),
+        is_patient_views)
+
+def warm_patient_views(patients):
+    """Queue background builds for the given patients, cancelling this session's other requests"""
+    pool = get_precompute_pool()
+    cache = get_artifact_cache()
+    owner = st.session_state.student_id
+    keys = []
+    for patient in patients:
+        version = patient_views_version(patient)
+        keys.append(version)
+        if not cache.get('patient-views', version, is_patient_views)[0]:
+            pool.submit(owner, version, patient_views_job(patient))
+    pool.retain(owner, keys)
+
+def get_patient_views(patient, imported_claims=None):
+    """Return ``(views, pending)`` for a patient's claims views without waiting
+
+    ``views`` is None while a background build is in flight, and
+    ``pending`` is its future. Views over just-imported claims, and views
+    the full queue cannot take, are built on demand.
+    """
+    if imported_claims:
+        patient = {**patient, 'claims': patient['claims'] + imported_claims}
+        return get_artifact_cache().get_or_compute(
+            'patient-views', content_hash([patient_views_version(patient), imported_claims]),
+            lambda: build_patient_views(patient, get_claim_ruleset(CLAIM_RULES_VERSION), load_pricing_tables(PRICING_VERSION)),
+            is_patient_views), None
+    
+    version = patient_views_version(patient)
+    found, views = get_artifact_cache().get('patient-views', version, is_patient_views)
+    if found:
+        return views, None
+    future = get_precompute_pool().submit(st.session_state.student_id, version, patient_views_job(patient))
+    if future is None:
+        return patient_views_job(patient)(), None
+    if future.done() and not future.cancelled():
+        return future.result(), None
+    return None, future
+
+@st.fragment(run_every=PRECOMPUTE_POLL_SECONDS)
+def await_patient_views(pending):
+    """Show a placeholder until a background build finishes, then rerun the page to show it"""
+    if not pending.done():
+        st.info("⏳ Preparing claims views in the background...")
+        return
+    if not pending.cancelled() and pending.exception() is not None:
+        st.error(f"Could not prepare claims views: {pending.exception()}")
+        return
+    st.rerun()
+
+def empty_progress():
+    """Return the progress record of a student who has not answered anything"""
+    return {
+        'completed_cases': [],
+        'case_progress': {},
+        'student_stats': {'completed': 0, 'correct_answers': 0, 'total_answers': 0},
+        'topic_mastery': {}
+    }
+
+def apply_progress_delta(progress, delta):
+    """Merge one session's new answers into a stored progress record
+
+    Completed cases are unioned and counters are incremented, so answers
+    made by the same student on different workers are never lost.
+    """
+    completed = set(progress['completed_cases']) | set(delta['case_progress'])
+    progress['completed_cases'] = sorted(completed)
+    progress['case_progress'].update(delta['case_progress'])
+    stats = progress['student_stats']
+    stats['completed'] = len(completed)
+    stats['total_answers'] += delta['answers']
+    stats['correct_answers'] += delta['correct']
+    for topic, result in delta['topics'].items():
+        stored = progress['topic_mastery'].setdefault(topic, {'correct': 0, 'attempts': 0})
+        stored['correct'] += result['correct']
+        stored['attempts'] += result['attempts']
+    return progress
+
+def topic_results(results):
+    """Count correct answers and attempts per topic from ``(case, is_correct)`` pairs"""
+    topics = {}
+    for case, is_correct in results:
+        for topic in case.get('topics', []):
+            counts = topics.setdefault(topic, {'correct': 0, 'attempts': 0})
+            counts['attempts'] += 1
+            counts['correct'] += int(is_correct)
+    return topics
+
+def connect_shared_db(db_path):
+    """Open a connection to a SQLite database shared by all app processes
+
+    A long busy timeout lets concurrent writers queue instead of failing;
+    callers close the connection with ``contextlib.closing``.
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+class StateStore:
+    """Student progress shared by all app processes through SQLite in WAL mode
+
+    WAL lets every worker read while one writes. Each progress update
+    merges the session's new answers into the stored record inside one
+    write transaction, so a student can be served by several workers at once.
+    """
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with closing(connect_shared_db(self.db_path)) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS student_progress (
+                    student_id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS progress_events (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    student_id TEXT NOT NULL,
+                    completed INTEGER NOT NULL,
+                    correct INTEGER NOT NULL,
+                    total INTEGER NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS app_settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            """)
+    
+    def load_alias_salt(self):
+        """Return the deployment-wide secret for student aliases, creating it on first use"""
+        with closing(connect_shared_db(self.db_path)) as conn, conn:
+            conn.execute("INSERT OR IGNORE INTO app_settings (key, value) VALUES ('alias_salt', ?)",
+                         (secrets.token_hex(16),))
+            return conn.execute("SELECT value FROM app_settings WHERE key = 'alias_salt'").fetchone()[0]
+    
+    def load_progress(self, student_id):
+        """Return the stored progress for a student, or None"""
+        with closing(connect_shared_db(self.db_path)) as conn:
+            row = conn.execute(
+                "SELECT state FROM student_progress WHERE student_id = ?", (student_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def save_progress(self, student_id, delta):
+        """Merge new answers into a student's progress, append a leaderboard event and return the result"""
+        with closing(connect_shared_db(self.db_path)) as conn, conn:
+            # Take the write lock before reading so concurrent merges serialize
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT state FROM student_progress WHERE student_id = ?", (student_id,)
+            ).fetchone()
+            progress = apply_progress_delta(json.loads(row[0]) if row else empty_progress(), delta)
+            stats = progress['student_stats']
+            conn.execute(
+                "INSERT INTO student_progress (student_id, state, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(student_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                (student_id, json.dumps(progress), time.time())
+            )
+            conn.execute(
+                "INSERT INTO progress_events (student_id, completed, correct, total) VALUES (?, ?, ?, ?)",
+                (student_id, stats['completed'], stats['correct_answers'], stats['total_answers'])
+            )
+        return progress
+    
+    def load_leaderboard_snapshot(self):
+        """Return ``(last_event_seq, [(student_id, stats), ...])`` from one consistent read"""
+        with closing(connect_shared_db(self.db_path)) as conn:
+            conn.execute("BEGIN")
+            last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM progress_events").fetchone()[0]
+            rows = conn.execute("SELECT student_id, state FROM student_progress").fetchall()
+            conn.execute("COMMIT")
+        return last_seq, [(student_id, json.loads(state)['student_stats']) for student_id, state in rows]
+    
+    def load_events_since(self, seq):
+        """Return progress events appended after ``seq``"""
+        with closing(connect_shared_db(self.db_path)) as conn:
+            return conn.execute(
+                "SELECT seq, student_id, completed, correct, total FROM progress_events WHERE seq > ? ORDER BY seq",
+                (seq,)
+            ).fetchall()
+
+@st.cache_resource
+def get_state_store():
+    """Return the shared state store, or None in single-process mode"""
+    return StateStore(STATE_DB_PATH) if STATE_DB_PATH else None
+
+def hydrate_progress(progress):
+    """Replace this session's progress with a stored record"""
+    st.session_state.completed_cases = set(progress['completed_cases'])
+    st.session_state.case_progress = progress['case_progress']
+    st.session_state.student_stats = progress['student_stats']
+    st.session_state.topic_mastery = progress['topic_mastery']
+    # Derived selector state is rebuilt from the restored mastery vector
+    st.session_state.topic_cursor = {}
+    st.session_state.topic_heap = None
+
+def load_shared_progress():
+    """Hydrate this session from the shared state store on first run"""
+    store = get_state_store()
+    if store is None or st.session_state.progress_loaded:
+        return
+    st.query_params['student'] = st.session_state.student_id
+    progress = store.load_progress(st.session_state.student_id)
+    if progress is not None:
+        hydrate_progress(progress)
+    st.session_state.progress_loaded = True
+
+def save_shared_progress(case_progress, answers, correct, topics):
+    """Merge this session's new answers into the shared store and adopt the merged record
+
+    Rehydrating after every write also brings in answers the same student
+    made in other sessions since this one was loaded.
+    """
+    store = get_state_store()
+    if store is None:
+        return
+    hydrate_progress(store.save_progress(st.session_state.student_id, {
+        'case_progress': case_progress,
+        'answers': answers,
+        'correct': correct,
+        'topics': topics
+    }))
+
+# Synthetic CMS-style pricing tables (override with EHR_FEE_SCHEDULE_CSV / EHR_DRG_WEIGHTS_CSV)
+FEE_SCHEDULE_CSV = """code,description,value
+99202,Office visit new patient (15-29 min),140.00
+99203,Office visit new patient (30-44 min),210.00
+99212,Office visit established (10-19 min),110.00
+99213,Office visit established (20-29 min),175.00
+99214,Office visit established (30-39 min),240.00
+99215,Office visit established (40-54 min),320.00
+99283,Emergency department visit (moderate),142.00
+99284,Emergency department visit (high),265.00
+80053,Comprehensive metabolic panel,120.00
+85025,Complete blood count,10.50
+93000,Electrocardiogram with interpretation,17.00
+93306,Echocardiogram complete,205.00
+77067,Screening mammography bilateral,280.00
+G0438,Annual wellness visit initial,250.00
+G0439,Annual wellness visit subsequent,170.00
+45385,Colonoscopy with polypectomy,470.00
+70553,MRI brain with and without contrast,375.00
+"""
+
+DRG_WEIGHTS_CSV = """code,description,value
+175,Pulmonary embolism with MCC,1.4862
+190,Chronic obstructive pulmonary disease with MCC,1.1541
+194,Simple pneumonia and pleurisy with CC,1.0625
+246,Percutaneous cardiovascular procedure with drug-eluting stent with MCC,3.2471
+247,Percutaneous cardiovascular procedure with drug-eluting stent without MCC,2.0654
+280,Acute myocardial infarction discharged alive with MCC,1.7044
+291,Heart failure and shock with MCC,1.3454
+292,Heart failure and shock with CC,0.9185
+392,Esophagitis and gastroenteritis without MCC,0.7525
+470,Major joint replacement of lower extremity without MCC,1.9003
+871,Septicemia without mechanical ventilation with MCC,1.8564
+"""
+
+# Inpatient base rate used with DRG weights (synthetic IPPS rate)
+MEDICARE_IPPS_BASE_RATE = 6400.00
+PRICING_RECORD_DTYPE = np.dtype([('code', 'S8'), ('description', 'S80'), ('value', 'f8')])
+
+class PricingTable:
+    """Memory-mapped code table (fee schedule or DRG weights)
+
+    Rows are stored as fixed-width records in a .npy file opened with
+    ``mmap_mode='r'``, so workers share the pages and only the touched rows
+    are read. A hash index over the codes gives O(1) single lookups and a
+    vectorized join via ``get_indexer``.
+    """
+    
+    def __init__(self, records):
+        self.records = records
+        self.index = pd.Index(np.char.decode(records['code'], 'ascii'))
+    
+    def lookup(self, code):
+        """Return ``(description, value)`` for a code, or None"""
+        try:
+            row = self.records[self.index.get_loc(str(code))]
+        except KeyError:
+            return None
+        return row['description'].decode('ascii'), float(row['value'])
+    
+    def values(self, codes):
+        """Return the value for each code as a float array (NaN when unknown)"""
+        positions = self.index.get_indexer(codes)
+        values = np.asarray(self.records['value'])[np.maximum(positions, 0)]
+        return np.where(positions >= 0, values, np.nan)
+
+def compile_pricing_table(csv_text, directory):
+    """Write a pricing CSV as a fixed-width .npy file and return its path"""
+    path = os.path.join(directory, f"pricing-{content_hash(csv_text)}.npy")
+    if not os.path.exists(path):
+        df = pd.read_csv(io.StringIO(csv_text), dtype={'code': str})
+        records = np.zeros(len(df), dtype=PRICING_RECORD_DTYPE)
+        records['code'] = df['code'].str.encode('ascii')
+        records['description'] = df['description'].str.slice(0, 80).str.encode('ascii', 'replace')
+        records['value'] = df['value'].astype(float)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, records)
+        os.replace(tmp_path, path)
+    return path
+
+def read_pricing_csv(env_var, default_csv):
+    """Return the pricing CSV text from the file named by env_var, or the default"""
+    path = os.environ.get(env_var)
+    if not path:
+        return default_csv
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+# Hashes the table contents, so editing a pricing file in place reprices
+PRICING_VERSION = content_hash([read_pricing_csv('EHR_FEE_SCHEDULE_CSV', FEE_SCHEDULE_CSV),
+                                read_pricing_csv('EHR_DRG_WEIGHTS_CSV', DRG_WEIGHTS_CSV)])
+
+@st.cache_resource
+def load_pricing_tables(version=None):
+    """Load the fee schedule and DRG weight tables for a pricing version as memory-mapped arrays"""
+    directory = get_artifact_cache().disk_dir or os.path.join(tempfile.gettempdir(), 'ehr_pricing')
+    os.makedirs(directory, exist_ok=True)
+    tables = {}
+    for name, env_var, default_csv in (('fee_schedule', 'EHR_FEE_SCHEDULE_CSV', FEE_SCHEDULE_CSV),
+                                       ('drg_weights', 'EHR_DRG_WEIGHTS_CSV', DRG_WEIGHTS_CSV)):
+        path = compile_pricing_table(read_pricing_csv(env_var, default_csv), directory)
+        tables[name] = PricingTable(np.load(path, mmap_mode='r'))
+    return tables
+
+# Code widths in the pricing tables; numeric codes are zero-padded to these
+PRICING_CODE_WIDTHS = {'drg': 3, 'cpt': 5}
+
+def pricing_code(value, width):
+    """Return a DRG/CPT code as table text ('' when missing)
+
+    Numeric columns with gaps are read as float, so 194 arrives as 194.0
+    and 00100 as 100.0; both are turned back into the table's spelling.
+    """
+    if value is None or (isinstance(value, (float, np.floating)) and np.isnan(value)):
+        return ''
+    if isinstance(value, (int, np.integer)) or (isinstance(value, (float, np.floating)) and float(value).is_integer()):
+        return str(int(value)).zfill(width)
+    return str(value).strip()
+
+def normalize_pricing_codes(codes, width):
+    """Normalize a column of codes, converting each distinct value once"""
+    positions, uniques = pd.factorize(codes)
+    # Missing values factorize to -1, which picks the trailing ''
+    cleaned = np.array([pricing_code(value, width) for value in uniques] + [''], dtype=object)
+    return pd.Series(cleaned[positions], index=codes.index)
+
+def reprice_claims(claims_df, tables, coinsurance=20, base_rate=MEDICARE_IPPS_BASE_RATE):
+    """Price Medicare claims from the fee schedule and DRG tables
+
+    Works on a whole cohort at once: ``claims_df`` needs ``drg`` and/or
+    ``cpt`` columns, which are normalized to code strings ('' when
+    missing). Inpatient claims are paid ``base_rate * DRG weight``;
+    Part B claims are paid the fee schedule amount less coinsurance.
+    Returns ``(priced, unknown_codes)``: the frame with ``allowed`` and
+    ``medicare_paid`` columns (NaN when unpriced) and the sorted codes,
+    such as ``'DRG 999'``, that are missing from the tables.
+    """
+    priced = claims_df.copy()
+    for column, width in PRICING_CODE_WIDTHS.items():
+        priced[column] = (normalize_pricing_codes(priced[column], width) if column in priced
+                          else pd.Series('', index=priced.index, dtype=object))
+    
+    drg_allowed = tables['drg_weights'].values(priced['drg']) * base_rate
+    fee_allowed = tables['fee_schedule'].values(priced['cpt'])
+    is_inpatient = (priced['drg'] != '').to_numpy()
+    
+    priced['allowed'] = np.where(is_inpatient, drg_allowed, fee_allowed).round(2)
+    priced['medicare_paid'] = np.where(
+        is_inpatient, drg_allowed, fee_allowed * (1 - np.asarray(coinsurance) / 100)).round(2)
+    
+    unknown_drg = priced.loc[is_inpatient & np.isnan(drg_allowed), 'drg']
+    unknown_cpt = priced.loc[~is_inpatient & (priced['cpt'] != '').to_numpy() & np.isnan(fee_allowed), 'cpt']
+    unknown_codes = sorted({f"DRG {code}" for code in unknown_drg} | {f"CPT {code}" for code in unknown_cpt})
+    return priced, unknown_codes
+
+def get_medicare_pricing(patient, tables=None):
+    """Return ``(priced claims, unknown codes)`` from the Medicare tables, or None"""
+    if 'Medicare' not in patient['insurance']['primary']:
+        return None
+    if not any('drg' in c or 'cpt' in c for c in patient['claims']):
+        return None
+    priced, unknown_codes = reprice_claims(pd.DataFrame(patient['claims']),
+                                           tables or load_pricing_tables(PRICING_VERSION),
+                                           coinsurance=patient['insurance'].get('coinsurance', 20))
+    priced['code'] = np.where(priced['drg'] != '', 'DRG ' + priced['drg'],
+                              np.where(priced['cpt'] != '', 'CPT ' + priced['cpt'], ''))
+    return priced, unknown_codes
+
+# 2024 HHS poverty guidelines (48 contiguous states)
+FPL_BASE = 15060
+FPL_PER_ADDITIONAL_PERSON = 5380
+
+# Charity care sliding scale: (upper FPL % bound, discount %)
+CHARITY_CARE_TIERS = [(100, 100), (200, 80), (300, 50), (400, 20)]
+
+def federal_poverty_level(household_size):
+    """Return the FPL income for a household size (scalar or array)"""
+    return FPL_BASE + FPL_PER_ADDITIONAL_PERSON * (np.maximum(np.asarray(household_size), 1) - 1)
+
+def charity_care_discount(household_size, household_income):
+    """Return ``(fpl_percent, discount_percent)`` for one household or arrays of them
+
+    The tier is found with a single ``searchsorted`` over the sliding
+    scale, so whole rosters are classified in one vectorized call.
+    """
+    fpl_percent = np.asarray(household_income, dtype=float) / federal_poverty_level(household_size) * 100
+    limits = np.array([limit for limit, _ in CHARITY_CARE_TIERS])
+    discounts = np.array([discount for _, discount in CHARITY_CARE_TIERS] + [0])
+    return fpl_percent, discounts[np.searchsorted(limits, fpl_percent, side='left')]
+
+def months_to_payoff(balance, monthly_payment, annual_rate=0.0):
+    """Return the number of monthly payments needed to clear a balance (vectorized)"""
+    balance = np.asarray(balance, dtype=float)
+    monthly_payment = np.asarray(monthly_payment, dtype=float)
+    rate = annual_rate / 12
+    if rate == 0:
+        return np.ceil(balance / monthly_payment)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        months = -np.log(1 - rate * balance / monthly_payment) / np.log(1 + rate)
+    # Payments that never cover the interest never pay the balance off
+    return np.where(monthly_payment > balance * rate, np.ceil(months), np.inf)
+
+def charity_care_batch(roster, annual_rate=0.0):
+    """Apply the sliding scale and payment plans to a whole roster
+
+    ``roster`` needs ``household_size``, ``household_income``, ``balance``
+    and ``monthly_payment`` columns; FPL %, discount, discounted balance
+    and months to payoff are added as new columns.
+    """
+    result = roster.copy()
+    fpl_percent, discount = charity_care_discount(result['household_size'], result['household_income'])
+    result['fpl_percent'] = fpl_percent.round(1)
+    result['discount_percent'] = discount
+    result['discounted_balance'] = (result['balance'] * (1 - discount / 100)).round(2)
+    result['months_to_payoff'] = months_to_payoff(
+        result['discounted_balance'], result['monthly_payment'], annual_rate)
+    return result
+
+@st.cache_data(max_entries=256)
+def payment_plan_schedule(balance, monthly_payment, annual_rate=0.0, max_months=600):
+    """Return the amortization schedule for a payment plan as a DataFrame
+
+    Raises ValueError when the plan never pays off or needs more than
+    ``max_months`` payments.
+    """
+    rate = annual_rate / 12
+    if monthly_payment <= balance * rate:
+        raise ValueError("Monthly payment does not cover the interest on this balance")
+    if months_to_payoff(balance, monthly_payment, annual_rate) > max_months:
+        raise ValueError(f"This plan would take more than {max_months} months to pay off - "
+                         f"increase the monthly payment")
+    rows = []
+    remaining = balance
+    month = 0
+    while remaining > 0.005:
+        month += 1
+        interest = remaining * rate
+        payment = min(monthly_payment, remaining + interest)
+        remaining = remaining + interest - payment
+        rows.append({
+            'Month': month,
+            'Payment ($)': round(payment, 2),
+            'Interest ($)': round(interest, 2),
+            'Principal ($)': round(payment - interest, 2),
+            'Remaining Balance ($)': round(max(remaining, 0.0), 2)
+        })
+    return pd.DataFrame(rows)
+
+@st.cache_data(max_entries=64)
+def project_accumulators(deductible, deductible_met, coinsurance, out_of_pocket_max, oop_met,
+                         hsa_balance=0.0, monthly_contribution=0.0, claims_per_month=1.0,
+                         mean_claim_cost=500.0, cost_cv=1.5, months=12, paths=5000, seed=0):
+    """Simulate month-by-month deductible, out-of-pocket and HSA trajectories
+
+    Claims arrive as a Poisson process and claim costs are gamma
+    distributed, so each month's total allowed cost per path is a single
+    gamma draw. All paths advance together as NumPy arrays; the only Python
+    loop is over months. Returns ``(paths, months)`` arrays for
+    ``deductible_met``, ``oop_met``, ``hsa_balance`` and ``cash_paid``
+    (costs the HSA could not cover), plus the ``month`` numbers.
+    """
+    rng = np.random.default_rng(seed)
+    claim_counts = rng.poisson(claims_per_month, size=(paths, months))
+    shape = 1 / cost_cv ** 2
+    monthly_cost = rng.gamma(np.maximum(claim_counts * shape, 1e-9), mean_claim_cost * cost_cv ** 2)
+    monthly_cost *= claim_counts > 0
+    
+    ded = np.full(paths, float(deductible_met))
+    oop = np.full(paths, float(oop_met))
+    hsa = np.full(paths, float(hsa_balance))
+    cash = np.zeros(paths)
+    history = {name: np.empty((paths, months)) for name in ('deductible_met', 'oop_met', 'hsa_balance', 'cash_paid')}
+    
+    for month in range(months):
+        cost = monthly_cost[:, month]
+        toward_deductible = np.minimum(cost, np.maximum(deductible - ded, 0))
+        owed = toward_deductible + (cost - toward_deductible) * coinsurance / 100
+        owed = np.minimum(owed, np.maximum(out_of_pocket_max - oop, 0))
+        ded += toward_deductible
+        oop += owed
+        
+        hsa += monthly_contribution
+        from_hsa = np.minimum(hsa, owed)
+        hsa -= from_hsa
+        cash += owed - from_hsa
+        
+        history['deductible_met'][:, month] = ded
+        history['oop_met'][:, month] = oop
+        history['hsa_balance'][:, month] = hsa
+        history['cash_paid'][:, month] = cash
+    
+    history['month'] = np.arange(1, months + 1)
+    return history
+
+def percentile_bands(values, percentiles=(5, 25, 50, 75, 95)):
+    """Return ``{percentile: per-month values}`` across simulated paths"""
+    return dict(zip(percentiles, np.percentile(values, percentiles, axis=0)))
+
+def add_band_traces(fig, months, bands, name, color):
+    """Add a median line with 25-75 and 5-95 percentile bands to a figure"""
+    for low, high, opacity in ((5, 95, 0.15), (25, 75, 0.3)):
+        fig.add_trace(go.Scatter(x=months, y=bands[high], mode='lines', line=dict(width=0),
+                                 showlegend=False, hoverinfo='skip'))
+        fig.add_trace(go.Scatter(x=months, y=bands[low], mode='lines', line=dict(width=0),
+                                 fill='tonexty', fillcolor=color, opacity=opacity,
+                                 name=f"{name} {low}-{high}th pct", hoverinfo='skip'))
+    fig.add_trace(go.Scatter(x=months, y=bands[50], mode='lines', line=dict(color=color, width=3),
+                             name=f"{name} (median)"))
+
+def render_accumulator_projection(patient):
+    """Render the deductible / out-of-pocket / HSA year projection"""
+    insurance = patient['insurance']
+    has_hsa = 'hsa_balance' in insurance
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        deductible = st.number_input("Annual deductible ($)", min_value=0, step=250,
+                                     value=insurance['deductible'], key=f"proj_ded_{patient['id']}")
+        coinsurance = st.slider("Coinsurance (%)", 0, 50, insurance.get('coinsurance', 20),
+                                key=f"proj_coins_{patient['id']}")
+    with col2:
+        out_of_pocket_max = st.number_input("Out-of-pocket maximum ($)", min_value=0, step=250,
+                                            value=insurance.get('out_of_pocket_max', deductible),
+                                            key=f"proj_oop_{patient['id']}")
+        monthly_contribution = st.slider("Monthly HSA contribution ($)", 0, 700, 200, step=25,
+                                         key=f"proj_contrib_{patient['id']}", disabled=not has_hsa)
+    with col3:
+        claims_per_month = st.slider("Expected claims per month", 0.1, 5.0, 1.0, step=0.1,
+                                     key=f"proj_rate_{patient['id']}")
+        mean_claim_cost = st.slider("Average claim cost ($)", 50, 5000, 500, step=50,
+                                    key=f"proj_cost_{patient['id']}")
+    
+    deductible_met = min(insurance.get('deductible_met', 0), deductible)
+    projection = project_accumulators(
+        deductible, deductible_met, coinsurance, out_of_pocket_max,
+        max(insurance.get('oop_met', deductible_met), deductible_met),
+        insurance.get('hsa_balance', 0), monthly_contribution if has_hsa else 0,
+        claims_per_month, mean_claim_cost)
+    months = projection['month']
+    
+    fig = go.Figure()
+    add_band_traces(fig, months, percentile_bands(projection['oop_met']), 'Out-of-pocket spent', '#ef4444')
+    if has_hsa:
+        add_band_traces(fig, months, percentile_bands(projection['hsa_balance']), 'HSA balance', '#06b6d4')
+    fig.add_hline(y=out_of_pocket_max, line_dash='dash', line_color='#6b7280', annotation_text='OOP maximum')
+    fig.update_layout(height=420, title='Projected Accumulators Over the Next 12 Months',
+                      xaxis_title='Month', yaxis_title='Dollars ($)')
+    st.plotly_chart(fig, use_container_width=True)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Chance of Reaching OOP Max", f"{(projection['oop_met'][:, -1] >= out_of_pocket_max).mean():.0%}")
+    with col2:
+        st.metric("Median Year-End Out-of-Pocket", f"${np.median(projection['oop_met'][:, -1]):,.0f}")
+    with col3:
+        if has_hsa:
+            st.metric("Chance HSA Runs Short", f"{(projection['cash_paid'][:, -1] > 0).mean():.0%}")
+
+def render_charity_care_calculator(patient):
+    """Render the charity care discount and payment plan calculator"""
+    insurance = patient['insurance']
+    gross_charges = sum(c['amount'] for c in patient['claims'])
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        household_size = st.number_input(
+            "Household size", min_value=1, max_value=12,
+            value=insurance.get('household_size', 1), key=f"household_size_{patient['id']}")
+        household_income = st.number_input(
+            "Annual household income ($)", min_value=0, step=1000,
+            value=insurance.get('household_income', 0), key=f"household_income_{patient['id']}")
+    with col2:
+        monthly_payment = st.number_input(
+            "Monthly payment ($)", min_value=10, step=10,
+            value=insurance.get('payment_plan_monthly', 100), key=f"monthly_payment_{patient['id']}")
+        annual_rate = st.number_input(
+            "Annual interest rate (%)", min_value=0.0, max_value=20.0, value=0.0, step=0.5,
+            key=f"plan_rate_{patient['id']}") / 100
+    
+    fpl_percent, discount = charity_care_discount(household_size, household_income)
+    fpl_percent, discount = float(fpl_percent), int(discount)
+    discounted_balance = round(gross_charges * (1 - discount / 100), 2)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Income vs. FPL", f"{fpl_percent:.0f}%",
+                  help=f"FPL for a household of {household_size}: ${int(federal_poverty_level(household_size)):,}")
+    with col2:
+        st.metric("Charity Care Discount", f"{discount}%")
+    with col3:
+        st.metric("Balance After Discount", f"${discounted_balance:,.2f}", f"-${gross_charges - discounted_balance:,.2f}")
+    
+    if discounted_balance > 0:
+        try:
+            schedule = payment_plan_schedule(discounted_balance, monthly_payment, annual_rate)
+        except ValueError as e:
+            st.error(str(e))
+            return
+        st.markdown(f"**Payoff:** {len(schedule)} months "
+                    f"(total paid ${schedule['Payment ($)'].sum():,.2f})")
+        st.dataframe(schedule, use_container_width=True, hide_index=True, height=250)
+
+class Leaderboard:
+    """Incrementally maintained class ranking by completion, then accuracy
+
+    Students fall into score buckets (cases completed x whole accuracy
+    percent) counted by a Fenwick tree. An answer moves one student
+    between buckets in O(log B); percentile and top-k queries are prefix
+    sums and order-statistic searches over the tree, so nothing is
+    re-sorted when the class grows.
+    """
+    
+    def __init__(self, max_completed):
+        self.max_completed = max_completed
+        self.size = (max_completed + 1) * 101
+        self.tree = [0] * (self.size + 1)
+        self.buckets = {}
+        self.students = {}
+        self.last_event_seq = 0
+        self.lock = threading.Lock()
+        # Serializes event replay, which spans a database read
+        self.refresh_lock = threading.Lock()
+    
+    def bucket_for(self, completed, correct, total):
+        accuracy = round(correct / total * 100) if total else 0
+        return min(completed, self.max_completed) * 101 + accuracy
+    
+    def _add(self, bucket, delta):
+        i = bucket + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+    
+    def _count_through(self, bucket):
+        """Number of students in buckets <= bucket"""
+        i, total = bucket + 1, 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+    
+    def _bucket_at_rank(self, rank):
+        """Smallest bucket whose cumulative count reaches ``rank`` (1-based)"""
+        position, step = 0, 1 << self.size.bit_length()
+        while step:
+            if position + step <= self.size and self.tree[position + step] < rank:
+                position += step
+                rank -= self.tree[position]
+            step >>= 1
+        return position
+    
+    def update(self, student_id, completed, correct, total):
+        """Record a student's latest stats"""
+        bucket = self.bucket_for(completed, correct, total)
+        with self.lock:
+            previous = self.students.get(student_id)
+            if previous is not None:
+                if previous['bucket'] == bucket:
+                    previous.update(completed=completed, correct=correct, total=total)
+                    return
+                self._add(previous['bucket'], -1)
+                self.buckets[previous['bucket']].discard(student_id)
+            self._add(bucket, 1)
+            self.buckets.setdefault(bucket, set()).add(student_id)
+            self.students[student_id] = {'bucket': bucket, 'completed': completed,
+                                         'correct': correct, 'total': total}
+    
+    def percentile(self, student_id):
+        """Return the share of the class at or below this student's standing (0-100)"""
+        with self.lock:
+            student = self.students.get(student_id)
+            if student is None or not self.students:
+                return None
+            return self._count_through(student['bucket']) / len(self.students) * 100
+    
+    def rank(self, student_id):
+        """Return the student's 1-based rank (ties share a rank)"""
+        with self.lock:
+            student = self.students.get(student_id)
+            if student is None:
+                return None
+            return len(self.students) - self._count_through(student['bucket']) + 1
+    
+    def apply_events(self, load_events_since):
+        """Replay progress events newer than ``last_event_seq`` in order
+
+        One refresh runs at a time and ``last_event_seq`` only moves
+        forward, so overlapping refreshes never reapply older stats.
+        """
+        with self.refresh_lock:
+            for seq, student_id, completed, correct, total in load_events_since(self.last_event_seq):
+                if seq <= self.last_event_seq:
+                    continue
+                self.update(student_id, completed, correct, total)
+                self.last_event_seq = seq
+    
+    def top(self, k=10):
+        """Return the top-k students as ``(rank, student_id, stats)`` tuples"""
+        results = []
+        with self.lock:
+            remaining = len(self.students)
+            while remaining > 0 and len(results) < k:
+                bucket = self._bucket_at_rank(remaining)
+                members = self.buckets[bucket]
+                rank = len(self.students) - remaining + 1
+                for student_id in heapq.nsmallest(k - len(results), members):
+                    results.append((rank, student_id, self.students[student_id]))
+                remaining -= len(members)
+        return results
+
+@st.cache_resource
+def get_alias_salt():
+    """Return the secret that keys student aliases (shared by all workers in multi-worker mode)"""
+    store = get_state_store()
+    return (store.load_alias_salt() if store is not None else secrets.token_hex(16)).encode('ascii')
+
+def student_alias(student_id):
+    """Return a stable public alias for a student
+
+    The student id doubles as the login in multi-worker mode, so it is
+    never shown to other students; the alias is a keyed hash that cannot
+    be turned back into the id.
+    """
+    digest = hmac.new(get_alias_salt(), student_id.encode('utf-8'), hashlib.sha256).hexdigest()
+    return f"Student {digest[:6].upper()}"
+
+@st.cache_resource
+def get_leaderboard(max_completed):
+    """Return this process's leaderboard, seeded from the shared store if there is one"""
+    leaderboard = Leaderboard(max_completed)
+    store = get_state_store()
+    if store is not None:
+        leaderboard.last_event_seq, snapshot = store.load_leaderboard_snapshot()
+        for student_id, stats in snapshot:
+            leaderboard.update(student_id, stats['completed'], stats['correct_answers'], stats['total_answers'])
+    return leaderboard
+
+def refresh_leaderboard():
+    """Apply progress events other workers have written since the last refresh"""
+    leaderboard = get_leaderboard(len(LEARNING_CASES))
+    store = get_state_store()
+    if store is not None:
+        leaderboard.apply_events(store.load_events_since)
+    return leaderboard
+
+def record_leaderboard_progress():
+    """Push this student's current stats into the local leaderboard"""
+    stats = st.session_state.student_stats
+    get_leaderboard(len(LEARNING_CASES)).update(
+        st.session_state.student_id, stats['completed'], stats['correct_answers'], stats['total_answers'])
+
+def render_leaderboard():
+    """Render the class leaderboard and the student's own standing"""
+    st.markdown("## 🏆 Class Leaderboard")
+    leaderboard = refresh_leaderboard()
+    student_id = st.session_state.student_id
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Students Ranked", len(leaderboard.students))
+    with col2:
+        rank = leaderboard.rank(student_id)
+        st.metric("Your Rank", f"#{rank}" if rank else "Not ranked yet")
+    with col3:
+        percentile = leaderboard.percentile(student_id)
+        st.metric("Your Percentile", f"{percentile:.0f}th" if percentile is not None else "-")
+    
+    top = leaderboard.top(10)
+    if not top:
+        st.info("No one has answered a case yet. Answer a case to appear on the leaderboard.")
+        return
+    st.dataframe(
+        pd.DataFrame([{
+            'Rank': rank,
+            'Student': "You" if sid == student_id else student_alias(sid),
+            'Cases Completed': stats['completed'],
+            'Accuracy': f"{stats['correct'] / stats['total']:.0%}" if stats['total'] else "-"
+        } for rank, sid, stats in top]),
+        use_container_width=True, hide_index=True
+    )
+    st.caption("Ranked by cases completed, then by answer accuracy.")
+
 def calculate_completion_stats():
     """Calculate overall completion statistics"""
     total_cases = len(LEARNING_CASES)
@@ -588,6 +2492,16 @@ def handle_case_answer(case_id, selected_option, correct_answer):
     st.session_state.student_stats['total_answers'] += 1
     if is_correct:
         st.session_state.student_stats['correct_answers'] += 1
+    
+    # Update topic mastery for adaptive case selection
+    case = get_case_bank()['cases'].get(case_id)
+    if case is not None:
+        record_topic_result(case, is_correct)
+    
+    save_shared_progress(
+        {case_id: st.session_state.case_progress[case_id]}, 1, int(is_correct),
+        topic_results([(case, is_correct)] if case is not None else []))
+    record_leaderboard_progress()
 
 def render_learning_case(case):
     """Render an interactive learning case"""
@@ -651,8 +2565,338 @@ def render_learning_case(case):
                 handle_case_answer(case['id'], selected_option, case['correct'])
                 st.rerun()
 
+# Timed exam settings
+EXAM_DB_PATH = os.environ.get('EHR_EXAM_DB', STATE_DB_PATH or 'exam_results.db')
+EXAM_SIZE = 10
+EXAM_DURATION_MINUTES = 20
+
+def build_exam(student_id, seed, attempt=0, size=EXAM_SIZE, duration_minutes=EXAM_DURATION_MINUTES):
+    """Draw a reproducible random subset of cases for one student's exam
+
+    The attempt number is part of the seed, so retaking an exam after
+    reading the explanations draws a different set of cases.
+    """
+    case_ids = sorted(get_case_bank()['cases'])
+    rng = random.Random(f"{student_id}:{seed}:{attempt}")
+    return {
+        'exam_id': uuid.uuid4().hex,
+        'student_id': student_id,
+        'seed': seed,
+        'attempt': attempt,
+        'case_ids': rng.sample(case_ids, min(size, len(case_ids))),
+        'started_at': time.time(),
+        'duration_seconds': duration_minutes * 60,
+        'result': None
+    }
+
+def score_exam(exam, answers, submitted_at):
+    """Score all buffered exam answers in a single pass"""
+    bank = get_case_bank()
+    items = []
+    for case_id in exam['case_ids']:
+        selected = answers.get(case_id)
+        items.append({
+            'case_id': case_id,
+            'selected': selected,
+            'correct': selected is not None and selected == bank['cases'][case_id]['correct']
+        })
+    elapsed = submitted_at - exam['started_at']
+    return {
+        'exam_id': exam['exam_id'],
+        'student_id': exam['student_id'],
+        'seed': exam['seed'],
+        'submitted_at': submitted_at,
+        'elapsed_seconds': elapsed,
+        'late': elapsed > exam['duration_seconds'],
+        'score': sum(1 for item in items if item['correct']),
+        'total': len(items),
+        'items': items
+    }
+
+class ExamResultStore:
+    """Scored exams in SQLite, shared by all app processes
+
+    The schema is created once per process and the database runs in WAL
+    mode, so a whole class submitting at once only queues on the single
+    insert each submission makes.
+    """
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with closing(connect_shared_db(self.db_path)) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS exam_results (
+                    exam_id TEXT PRIMARY KEY,
+                    student_id TEXT NOT NULL,
+                    seed INTEGER NOT NULL,
+                    submitted_at REAL NOT NULL,
+                    elapsed_seconds REAL NOT NULL,
+                    late INTEGER NOT NULL,
+                    score INTEGER NOT NULL,
+                    total INTEGER NOT NULL,
+                    items TEXT NOT NULL
+                )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS exam_results_student_seed ON exam_results (student_id, seed)"
+            )
+    
+    def count_attempts(self, student_id, seed):
+        """Return how many exams a student has submitted for a seed"""
+        with closing(connect_shared_db(self.db_path)) as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM exam_results WHERE student_id = ? AND seed = ?", (student_id, seed)
+            ).fetchone()[0]
+    
+    def save_result(self, result):
+        """Persist a scored exam in one write"""
+        with closing(connect_shared_db(self.db_path)) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO exam_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (result['exam_id'], result['student_id'], result['seed'], result['submitted_at'],
+                 result['elapsed_seconds'], int(result['late']), result['score'], result['total'],
+                 json.dumps(result['items']))
+            )
+
+@st.cache_resource
+def get_exam_store():
+    """Return the shared exam results store"""
+    return ExamResultStore(EXAM_DB_PATH)
+
+def render_exam_results(exam):
+    """Render the scored exam with explanations"""
+    result = exam['result']
+    bank = get_case_bank()
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Score", f"{result['score']}/{result['total']}")
+    with col2:
+        st.metric("Percentage", f"{result['score'] / result['total']:.0%}" if result['total'] else "0%")
+    with col3:
+        st.metric("Time Used", f"{result['elapsed_seconds'] / 60:.1f} min")
+    
+    if result['late']:
+        st.warning("⏰ Submitted after the time limit - this attempt is flagged as late.")
+    
+    for i, item in enumerate(result['items'], 1):
+        case = bank['cases'][item['case_id']]
+        status = "✅" if item['correct'] else "❌"
+        with st.expander(f"{status} Question {i}: {case['title']}"):
+            st.markdown(f"**Question:** {case['question']}")
+            if item['selected'] is None:
+                st.info("No answer submitted.")
+            else:
+                st.markdown(f"**Your answer:** {chr(65+item['selected'])}. {case['options'][item['selected']]}")
+            st.markdown(f"**Correct answer:** {chr(65+case['correct'])}. {case['options'][case['correct']]}")
+            st.markdown(f"**Explanation:** {case['explanation']}")
+
+def render_exam_view():
+    """Render the timed exam mode"""
+    st.markdown("## ⏱️ Timed Exam")
+    exam = st.session_state.exam
+    
+    if exam is None:
+        st.markdown(f"""
+        <div class="info-box">
+            <p>You will get <strong>{EXAM_SIZE}</strong> randomly selected cases and have
+            <strong>{EXAM_DURATION_MINUTES} minutes</strong> to answer them. Answers are only
+            scored when you submit the whole exam, and explanations are shown afterwards.</p>
+        </div>
+        """, unsafe_allow_html=True)
+        seed = st.number_input("Exam seed (provided by your instructor)", min_value=0, value=0, step=1)
+        if st.button("Start Exam", type="primary"):
+            attempt = get_exam_store().count_attempts(st.session_state.student_id, int(seed))
+            st.session_state.exam = build_exam(st.session_state.student_id, int(seed), attempt)
+            st.rerun()
+        return
+    
+    if exam['result'] is not None:
+        render_exam_results(exam)
+        if st.button("Start New Exam"):
+            st.session_state.exam = None
+            st.rerun()
+        return
+    
+    remaining = exam['duration_seconds'] - (time.time() - exam['started_at'])
+    deadline = time.strftime('%H:%M', time.localtime(exam['started_at'] + exam['duration_seconds']))
+    if remaining > 0:
+        st.info(f"⏱️ About {remaining / 60:.0f} minutes remaining (due at {deadline})")
+    else:
+        st.warning(f"⏰ Time is up (due at {deadline}). Submit now - late submissions are flagged.")
+    
+    # Widgets inside a form only reach the server when the form is submitted
+    bank = get_case_bank()
+    with st.form(f"exam_form_{exam['exam_id']}"):
+        for i, case_id in enumerate(exam['case_ids'], 1):
+            case = bank['cases'][case_id]
+            st.markdown(f"#### Question {i}: {case['title']}")
+            st.markdown(f"**Scenario:** {case['scenario']}")
+            st.radio(
+                case['question'],
+                options=range(len(case['options'])),
+                format_func=lambda x, case=case: f"**{chr(65+x)}.** {case['options'][x]}",
+                index=None,
+                key=f"exam_{exam['exam_id']}_{case_id}"
+            )
+            st.divider()
+        submitted = st.form_submit_button("Submit Exam", type="primary")
+    
+    if submitted:
+        answers = {case_id: st.session_state.get(f"exam_{exam['exam_id']}_{case_id}")
+                   for case_id in exam['case_ids']}
+        exam['result'] = score_exam(exam, answers, time.time())
+        get_exam_store().save_result(exam['result'])
+        results = [(bank['cases'][item['case_id']], item['correct']) for item in exam['result']['items']]
+        for case, is_correct in results:
+            record_topic_result(case, is_correct)
+        save_shared_progress({}, 0, 0, topic_results(results))
+        st.rerun()
+
+# Panel revenue simulator - annual visits per member and mean cost per visit by plan type
+PLAN_UTILIZATION = {
+    'Part A & B': {'visits': 8.0, 'cost': 310.0},
+    'Medicare Advantage (Part C)': {'visits': 7.0, 'cost': 280.0},
+    'PPO': {'visits': 4.5, 'cost': 260.0},
+    'Commercial PPO': {'visits': 4.5, 'cost': 250.0},
+    'HMO': {'visits': 4.0, 'cost': 210.0},
+    'Managed Care': {'visits': 5.0, 'cost': 180.0},
+    'Medicaid Managed Care': {'visits': 5.5, 'cost': 170.0},
+    'Military Health System': {'visits': 4.0, 'cost': 220.0},
+    'HDHP with HSA': {'visits': 3.0, 'cost': 240.0},
+    'Self-Pay': {'visits': 2.5, 'cost': 300.0}
+}
+REIMBURSEMENT_MODELS = ['Fee-for-Service', 'Capitation', 'Value-Based Payment']
+
+def expected_panel_pmpm(plan_types, utilization_multiplier=1.0):
+    """Return the expected cost per member per month for an even plan mix"""
+    annual = [PLAN_UTILIZATION[t]['visits'] * PLAN_UTILIZATION[t]['cost'] for t in plan_types]
+    return float(np.mean(annual)) * utilization_multiplier / 12
+
+@st.cache_data(max_entries=32)
+def simulate_panel_revenue(panel_size, plan_types, trials=5000, utilization_multiplier=1.0,
+                           dispersion=2.0, cost_cv=1.0, pmpm_rate=None, ffs_markup=0.10,
+                           shared_savings_rate=0.5, seed=0):
+    """Monte Carlo projection of a panel's annual revenue under each payment model
+
+    Members are split across ``plan_types`` at random each trial. Visits per
+    member follow a negative binomial (Poisson-gamma) distribution with the
+    given ``dispersion`` and visit costs are gamma distributed with
+    coefficient of variation ``cost_cv``. Because sums of these draw from
+    the same families, each plan group is sampled as one aggregate draw per
+    trial, so the work is O(trials x plan types), not O(trials x members).
+    
+    The capitation rate and the shared-savings benchmark are set at
+    baseline utilization, as a payer would, so ``utilization_multiplier``
+    moves only the practice's actual visits and costs.
+    
+    Returns ``{model: {'revenue', 'cost', 'margin'}}`` of per-trial arrays.
+    """
+    rng = np.random.default_rng(seed)
+    plan_types = list(plan_types)
+    baseline_visits = np.array([PLAN_UTILIZATION[t]['visits'] for t in plan_types])
+    visit_means = baseline_visits * utilization_multiplier
+    visit_costs = np.array([PLAN_UTILIZATION[t]['cost'] for t in plan_types])
+    
+    # Panel composition per trial: (trials, plans)
+    members = rng.multinomial(panel_size, np.full(len(plan_types), 1 / len(plan_types)), size=trials)
+    
+    # Sum of n NB(r, p) members is NB(n*r, p); mean per member = r(1-p)/p
+    p = dispersion / (dispersion + visit_means)
+    visits = rng.negative_binomial(np.maximum(members * dispersion, 1e-9), p) * (members > 0)
+    
+    # Sum of k Gamma(a, s) visit costs is Gamma(k*a, s)
+    shape = 1 / cost_cv ** 2
+    scale = visit_costs * cost_cv ** 2
+    cost = (rng.gamma(np.maximum(visits * shape, 1e-9), scale) * (visits > 0)).sum(axis=1)
+    
+    benchmark_cost = (members * baseline_visits * visit_costs).sum(axis=1)
+    ffs_revenue = (visits * visit_costs * (1 + ffs_markup)).sum(axis=1)
+    if pmpm_rate is None:
+        pmpm_rate = expected_panel_pmpm(plan_types)
+    capitation_revenue = np.full(trials, panel_size * pmpm_rate * 12.0)
+    # Two-sided shared savings against the baseline-cost benchmark
+    value_based_revenue = ffs_revenue + shared_savings_rate * (benchmark_cost - cost)
+    
+    results = {}
+    for model, revenue in zip(REIMBURSEMENT_MODELS, (ffs_revenue, capitation_revenue, value_based_revenue)):
+        results[model] = {'revenue': revenue, 'cost': cost, 'margin': revenue - cost}
+    return results
+
+def summarize_simulation(results):
+    """Summarize simulated margins per payment model"""
+    rows = []
+    for model, outcome in results.items():
+        margin = outcome['margin']
+        rows.append({
+            'Payment Model': model,
+            'Mean Revenue ($)': outcome['revenue'].mean(),
+            'Mean Margin ($)': margin.mean(),
+            '5th Percentile Margin ($)': np.percentile(margin, 5),
+            '95th Percentile Margin ($)': np.percentile(margin, 95),
+            'Probability of Loss': (margin < 0).mean()
+        })
+    return pd.DataFrame(rows)
+
+def render_panel_simulator():
+    """Render the capitation vs fee-for-service panel simulator"""
+    st.markdown("## 📈 Panel Revenue Simulator")
+    st.markdown("""
+    <div class="info-box">
+        <p>Project a provider panel's annual revenue and margin under each reimbursement model.
+        Fee-for-service revenue rises with utilization, capitation pays a fixed amount per member
+        so the provider carries the utilization risk, and value-based payment shares savings
+        (or losses) against an expected-cost benchmark.</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    all_plan_types = sorted(PLAN_UTILIZATION)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        panel_size = st.slider("Panel size (members)", 500, 20000, 2500, step=500)
+        plan_types = st.multiselect("Plan types in panel", all_plan_types, default=all_plan_types)
+        trials = st.select_slider("Monte Carlo trials", [1000, 2000, 5000, 10000], value=5000)
+    with col2:
+        utilization_multiplier = st.slider("Utilization vs. expected", 0.5, 2.0, 1.0, step=0.05)
+        dispersion = st.slider("Utilization dispersion (lower = more high utilizers)", 0.2, 10.0, 2.0)
+        cost_cv = st.slider("Cost per visit variability (CV)", 0.2, 3.0, 1.0)
+    with col3:
+        if not plan_types:
+            st.warning("Select at least one plan type.")
+            return
+        default_pmpm = round(expected_panel_pmpm(plan_types), 2)
+        pmpm_rate = st.number_input("Capitation rate (PMPM $)", min_value=0.0, value=default_pmpm, step=5.0)
+        ffs_markup = st.slider("FFS fee markup over cost", 0.0, 0.5, 0.10)
+        shared_savings_rate = st.slider("Value-based shared savings rate", 0.0, 1.0, 0.5)
+    
+    results = simulate_panel_revenue(
+        panel_size, tuple(plan_types), trials, utilization_multiplier, dispersion, cost_cv,
+        pmpm_rate, ffs_markup, shared_savings_rate)
+    
+    summary = summarize_simulation(results)
+    st.dataframe(
+        summary.style.format({
+            'Mean Revenue ($)': '${:,.0f}', 'Mean Margin ($)': '${:,.0f}',
+            '5th Percentile Margin ($)': '${:,.0f}', '95th Percentile Margin ($)': '${:,.0f}',
+            'Probability of Loss': '{:.1%}'
+        }),
+        use_container_width=True, hide_index=True
+    )
+    
+    fig = go.Figure()
+    for model in REIMBURSEMENT_MODELS:
+        fig.add_trace(go.Histogram(
+            x=results[model]['margin'], name=model, opacity=0.6, nbinsx=60,
+            marker_color=get_reimbursement_color(model)))
+    fig.update_layout(
+        barmode='overlay', height=400, title='Distribution of Annual Panel Margin',
+        xaxis_title='Margin ($)', yaxis_title='Trials')
+    st.plotly_chart(fig, use_container_width=True)
+
 def main():
     """Main application function"""
+    load_shared_progress()
     
     # Header
     st.markdown("""
@@ -666,6 +2910,8 @@ def main():
     # Sidebar
     with st.sidebar:
         st.title("🎯 Learning Dashboard")
+        app_mode = st.radio("Mode", ["Practice", "Timed Exam", "Panel Simulator", "Leaderboard"],
+                            horizontal=True, key="app_mode")
         
         # Progress metrics
         total_cases, completed, accuracy = calculate_completion_stats()
@@ -683,11 +2929,23 @@ def main():
             progress = completed / total_cases
             st.progress(progress, f"Overall Progress: {progress:.1%}")
         
+        # Adaptive recommendation
+        next_case, next_topic = select_next_case()
+        if next_case is not None:
+            st.markdown("### 🧭 Recommended Next Case")
+            st.markdown(f"**{next_case['title']}**")
+            st.caption(f"Focus topic: {next_topic} • Mastery {topic_mastery_score(next_topic):.0%}")
+            st.button("Open Case", key="open_recommended_case", on_click=open_case, args=(next_case,))
+        
         st.divider()
         
         # Filters
         st.markdown("### 🔍 Find Patients")
-        search_term = st.text_input("Search patients or insurance...")
+        search_term = st.text_input(
+            "Search patients, diagnoses, claims or cases...",
+            help="Matches names, insurance, diagnoses, medications, claim services and statuses, "
+                 "and learning case content. Partial words are matched as prefixes."
+        )
         
         plan_types = sorted(list(set([p['insurance']['planType'] for p in PATIENTS])))
         selected_plan = st.selectbox("Filter by Plan Type", ["All Plans"] + plan_types)
@@ -698,9 +2956,7 @@ def main():
         # Filter patients
         filtered_patients = PATIENTS
         if search_term:
-            filtered_patients = [p for p in filtered_patients 
-                               if search_term.lower() in p['name'].lower() or 
-                                  search_term.lower() in p['insurance']['primary'].lower()]
+            filtered_patients = search_patients(search_term)
         if selected_plan != "All Plans":
             filtered_patients = [p for p in filtered_patients if p['insurance']['planType'] == selected_plan]
         if selected_reimbursement != "All Models":
@@ -709,7 +2965,16 @@ def main():
         st.markdown(f"**{len(filtered_patients)} patients match your filters**")
     
     # Main content area
-    if st.session_state.selected_patient is None:
+    if app_mode == "Timed Exam":
+        render_exam_view()
+    
+    elif app_mode == "Panel Simulator":
+        render_panel_simulator()
+    
+    elif app_mode == "Leaderboard":
+        render_leaderboard()
+    
+    elif st.session_state.selected_patient is None:
         # Patient selection view
         st.markdown("## 👥 Select a Patient to Begin Learning")
         
@@ -746,9 +3011,12 @@ def main():
         
         st.divider()
         
+        # Warm claims views for the patients on this page in the background
+        warm_patient_views(filtered_patients[:PRECOMPUTE_PAGE_SIZE])
+        
         # Patient cards
         for patient in filtered_patients:
-            patient_cases = [c for c in LEARNING_CASES if c['patientId'] == patient['id']]
+            patient_cases = get_patient_cases(patient['id'])
             completed_cases = len([c for c in patient_cases if c['id'] in st.session_state.completed_cases])
             
             with st.container():
@@ -776,6 +3044,7 @@ def main():
                     st.write("")
                     if st.button(f"Explore Patient", key=f"select_{patient['id']}", type="primary"):
                         st.session_state.selected_patient = patient
+                        st.session_state.focus_case = None
                         st.rerun()
                     
                     if len(patient_cases) > 0:
@@ -785,6 +3054,7 @@ def main():
     else:
         # Patient detail view
         patient = st.session_state.selected_patient
+        warm_patient_views([patient])
         
         # Patient header
         col1, col2 = st.columns([4, 1])
@@ -807,8 +3077,13 @@ def main():
         with col2:
             if st.button("← Back to Patients", type="secondary"):
                 st.session_state.selected_patient = None
+                st.session_state.focus_case = None
                 st.rerun()
         
+        focus_case = get_case_bank()['cases'].get(st.session_state.focus_case)
+        if focus_case is not None and focus_case['patientId'] == patient['id']:
+            st.info(f"🧭 Recommended case **{focus_case['title']}** is open in the 📚 Learning Cases tab.")
+        
         # Tabs for patient information
         tab1, tab2, tab3, tab4, tab5 = st.tabs([
             "👤 Demographics", 
@@ -880,55 +3155,16 @@ def main():
             # Special programs
             if 'charity_care' in insurance:
                 st.success(f"🏥 **Charity Care Status:** {insurance['charity_care']}")
+                with st.expander("🧮 Charity Care & Payment Plan Calculator"):
+                    render_charity_care_calculator(patient)
             if 'hsa_balance' in insurance:
                 st.info(f"💰 **Health Savings Account:** ${insurance['hsa_balance']:,} available")
+            if 'deductible' in insurance:
+                with st.expander("📈 Year Projection: Deductible, Out-of-Pocket & HSA"):
+                    render_accumulator_projection(patient)
             if 'pregnancy_medicaid' in insurance and insurance['pregnancy_medicaid']:
                 st.info(f"🤱 **Pregnancy Medicaid:** Extended coverage through {insurance.get('postpartum_coverage', 'delivery')}")
         
-        with tab3:
-            st.markdown("### Claims History & Billing")
-            
-            if patient['claims']:
-                # Create claims dataframe
-                claims_df = pd.DataFrame(patient['claims'])
-                claims_df['patient_responsibility'] = claims_df['amount'] - claims_df['paid']
-                
-                # Claims table
-                st.dataframe(
-                    claims_df[['date', 'service', 'amount', 'paid', 'patient_responsibility', 'status']].rename(columns={
-                        'date': 'Date',
-                        'service': 'Service Description',
-                        'amount': 'Billed Amount ($)',
-                        'paid': 'Insurance Paid ($)',
-                        'patient_responsibility': 'Patient Owes ($)',
-                        'status': 'Claim Status'
-                    }),
-                    use_container_width=True
-                )
-                
-                # Summary metrics
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Total Billed", f"${claims_df['amount'].sum():,}")
-                with col2:
-                    st.metric("Insurance Paid", f"${claims_df['paid'].sum():,}")
-                with col3:
-                    st.metric("Patient Responsibility", f"${claims_df['patient_responsibility'].sum():,}")
-                
-                # Visualization
-                fig = px.bar(
-                    claims_df, 
-                    x='service', 
-                    y=['amount', 'paid'], 
-                    title='Claims Overview: Billed vs Paid Amounts',
-                    barmode='group',
-                    color_discrete_map={'amount': '#ef4444', 'paid': '#10b981'}
-                )
-                fig.update_layout(xaxis_tickangle=-45, height=400)
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("No claims data available for this patient.")
-        
         with tab4:
             st.markdown("### Clinical Information")
             
@@ -948,7 +3184,7 @@ def main():
             st.markdown("### Interactive Learning Cases")
             
             # Get patient-specific cases
-            patient_cases = [c for c in LEARNING_CASES if c['patientId'] == patient['id']]
+            patient_cases = get_patient_cases(patient['id'])
             
             if not patient_cases:
                 st.info(f"No learning cases available for {patient['name']} yet. Check back soon!")
@@ -985,9 +3221,70 @@ def main():
                     else:
                         status = "🔄 Available"
                         expanded = True
+                    if case['id'] == st.session_state.focus_case:
+                        status = f"🧭 Recommended • {status}"
+                        expanded = True
                     
                     with st.expander(f"Case {i}: {case['title']} - {status}", expanded=expanded):
                         render_learning_case(case)
+        
+        # The claims tab is rendered last so the other tabs show while its views are prepared
+        with tab3:
+            st.markdown("### Claims History & Billing")
+            
+            with st.expander("📥 Import X12 claim (837) or remittance (835) files"):
+                uploads = st.file_uploader(
+                    "X12 files", accept_multiple_files=True, key=f"x12_{patient['id']}")
+                if uploads and st.button("Import Claims", key=f"import_x12_{patient['id']}"):
+                    imported = []
+                    for upload in uploads:
+                        try:
+                            records = match_claims_to_patient(parse_x12(upload), patient)
+                        except ValueError as e:
+                            st.error(f"{upload.name}: {e}")
+                            continue
+                        imported.extend({k: r[k] for k in ('date', 'service', 'amount', 'paid', 'status')}
+                                        for r in records)
+                    st.session_state.imported_claims[patient['id']] = imported
+                    st.success(f"Imported {len(imported)} claim lines for {patient['name']}.")
+            
+            imported_claims = st.session_state.imported_claims.get(patient['id'], [])
+            if patient['claims'] or imported_claims:
+                views, pending = get_patient_views(patient, imported_claims)
+                if views is None:
+                    await_patient_views(pending)
+                else:
+                    claims = views['claims']
+                    
+                    # Claims table
+                    render_arrow_table(claims['display_table'], key=f"claims_page_{patient['id']}")
+                    
+                    # Summary metrics
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        st.metric("Total Billed", f"${claims['totals']['amount']:,.2f}")
+                    with col2:
+                        st.metric("Insurance Paid", f"${claims['totals']['paid']:,.2f}")
+                    with col3:
+                        st.metric("Patient Responsibility", f"${claims['totals']['patient_responsibility']:,.2f}")
+                    
+                    # Visualization
+                    st.plotly_chart(claims['figure'], use_container_width=True)
+                    
+                    # Payer rule check
+                    st.markdown("#### Payer Rule Check")
+                    render_arrow_table(views['rule_check'], key=f"rule_check_page_{patient['id']}", hide_index=True)
+                    
+                    # Medicare fee schedule / DRG pricing
+                    if views['pricing'] is not None:
+                        st.markdown("#### Medicare Pricing")
+                        render_arrow_table(views['pricing'], key=f"pricing_page_{patient['id']}")
+                        if views['unpriced_codes']:
+                            st.warning(f"No Medicare rate found for: {', '.join(views['unpriced_codes'])}")
+                        st.caption(f"Inpatient stays are paid the DRG weight × ${MEDICARE_IPPS_BASE_RATE:,.0f} base rate; "
+                                   "Part B services are paid the fee schedule amount less coinsurance.")
+            else:
+                st.info("No claims data available for this patient.")
 
 if __name__ == "__main__":
     main()